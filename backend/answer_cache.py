@@ -0,0 +1,176 @@
+"""
+On-disk cache of generated answers, in front of the LLM step of chat.
+
+An answer is reusable only if it was generated for the same user's library,
+at the same index content version (bumped by every ingestion and delete),
+from the same retrieved passages. Lookups try an exact match first, on the
+normalized question plus the set of retrieved chunk ids. Failing that, they
+try a semantic match: a cached question whose embedding has cosine similarity
+of at least ANSWER_CACHE_SIMILARITY with this one, and whose retrieved chunks
+overlap this retrieval by at least ANSWER_CACHE_MIN_OVERLAP. Entries expire
+after ANSWER_CACHE_TTL seconds, entries for older index versions are dropped,
+and the cache is bounded by entry count (least recently used go first).
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from query_embedder import normalize_query
+
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.db")
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_MIN_OVERLAP = float(os.getenv("ANSWER_CACHE_MIN_OVERLAP", "0.8"))
+
+def question_key(question: str) -> str:
+    return normalize_query(question).casefold()
+
+def chunks_key(chunk_ids: List[str]) -> str:
+    return hashlib.sha256("\n".join(sorted(chunk_ids)).encode("utf-8")).hexdigest()
+
+class AnswerCache:
+    """SQLite-backed answer cache with exact and embedding-similarity lookup."""
+
+    def __init__(self, path: str = ANSWER_CACHE_PATH, max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 ttl: float = ANSWER_CACHE_TTL, similarity: float = ANSWER_CACHE_SIMILARITY,
+                 min_overlap: float = ANSWER_CACHE_MIN_OVERLAP):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.min_overlap = min_overlap
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY,
+                scope TEXT NOT NULL,
+                index_version INTEGER NOT NULL,
+                question_key TEXT NOT NULL,
+                chunks_key TEXT NOT NULL,
+                chunk_ids TEXT NOT NULL,
+                question_vector BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                citations TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_scope ON answers (scope, index_version)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers (last_used)")
+        self._conn.commit()
+
+    def get(self, scope: str, index_version: int, question: str, chunk_ids: List[str],
+            question_vector: List[float]) -> Optional[dict]:
+        """
+        Returns {"answer", "citations", "match", "similarity"} for a reusable
+        answer, or None. match is "exact" or "semantic".
+        """
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, answer, citations FROM answers WHERE scope = ? AND index_version = ? "
+                "AND question_key = ? AND chunks_key = ? AND created > ? ORDER BY created DESC LIMIT 1",
+                (scope, index_version, question_key(question), chunks_key(chunk_ids), cutoff),
+            ).fetchone()
+            if row is not None:
+                self.exact_hits += 1
+                return self._hit(row, "exact", 1.0)
+
+            candidates = self._conn.execute(
+                "SELECT id, question_vector, chunk_ids FROM answers "
+                "WHERE scope = ? AND index_version = ? AND created > ?",
+                (scope, index_version, cutoff),
+            ).fetchall()
+            best = self._best_semantic_match(candidates, question_vector, set(chunk_ids))
+            if best is None:
+                self.misses += 1
+                return None
+            entry_id, similarity = best
+            row = self._conn.execute("SELECT id, answer, citations FROM answers WHERE id = ?", (entry_id,)).fetchone()
+            self.semantic_hits += 1
+            return self._hit(row, "semantic", similarity)
+
+    def _best_semantic_match(self, candidates, question_vector, chunk_ids: set):
+        if not candidates:
+            return None
+        query = np.asarray(question_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob, _ in candidates])
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        similarities = vectors @ query
+
+        for i in np.argsort(-similarities):
+            if similarities[i] < self.similarity:
+                break
+            cached_ids = set(json.loads(candidates[i][2]))
+            overlap = len(cached_ids & chunk_ids) / max(len(cached_ids | chunk_ids), 1)
+            if overlap >= self.min_overlap:
+                return candidates[i][0], float(similarities[i])
+        return None
+
+    def _hit(self, row, match: str, similarity: float) -> dict:
+        """Caller holds self._lock."""
+        entry_id, answer, citations = row
+        self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), entry_id))
+        self._conn.commit()
+        return {"answer": answer, "citations": json.loads(citations), "match": match, "similarity": similarity}
+
+    def put(self, scope: str, index_version: int, question: str, chunk_ids: List[str],
+            question_vector: List[float], answer: str, citations: List[dict]):
+        now = time.time()
+        with self._lock:
+            # Answers for older versions of this library can never be hit again
+            before = self._conn.total_changes
+            self._conn.execute(
+                "DELETE FROM answers WHERE scope = ? AND (index_version < ? OR created <= ?)",
+                (scope, index_version, now - self.ttl),
+            )
+            self.evictions += self._conn.total_changes - before
+            self._conn.execute(
+                "INSERT INTO answers (scope, index_version, question_key, chunks_key, chunk_ids, "
+                "question_vector, answer, citations, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    scope, index_version, question_key(question), chunks_key(chunk_ids), json.dumps(chunk_ids),
+                    np.asarray(question_vector, dtype=np.float32).tobytes(), answer, json.dumps(citations), now, now,
+                ),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self.evictions += excess
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+        }
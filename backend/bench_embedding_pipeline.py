@@ -0,0 +1,75 @@
+"""
+Compares sequential batch embedding with the pipelined EmbeddingPipeline
+against a simulated Ollama: one request at a time per server, a fixed
+per-request overhead plus a per-text cost, and a blocking checkpoint write
+per batch on our side (like ingestion's fsync'ed checkpoint).
+
+    python bench_embedding_pipeline.py [chunks] [servers]
+
+Reports throughput and how busy the servers were; the pipeline should keep
+them close to 100% busy.
+"""
+import sys
+import time
+import asyncio
+
+from embedding_pipeline import EmbeddingPipeline
+
+CHUNKS = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+SERVERS = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+REQUEST_OVERHEAD = 0.03  # seconds per request (HTTP, model dispatch)
+PER_TEXT = 0.002  # seconds of model time per chunk
+CHECKPOINT_SECONDS = 0.02  # our bookkeeping per batch
+DIM = 8
+
+class SimulatedServers:
+    def __init__(self, count: int):
+        self.locks = [asyncio.Lock() for _ in range(count)]
+        self.busy = 0.0
+
+    async def embed(self, texts):
+        lock = min(self.locks, key=lambda l: l.locked())  # an idle server if there is one
+        async with lock:
+            t0 = time.monotonic()
+            await asyncio.sleep(REQUEST_OVERHEAD + PER_TEXT * len(texts))
+            self.busy += time.monotonic() - t0
+        return [[float(len(t))] * DIM for t in texts]
+
+async def sequential(texts, servers, batch_size=100):
+    out = []
+    for i in range(0, len(texts), batch_size):
+        vectors = await servers.embed(texts[i:i + batch_size])
+        await asyncio.to_thread(time.sleep, CHECKPOINT_SECONDS)
+        out.extend(vectors)
+    return out
+
+async def pipelined(texts, servers):
+    pipeline = EmbeddingPipeline(servers.embed, in_flight=2 * SERVERS, batch_size=100)
+    out = []
+    async for vectors in pipeline.embed(texts):
+        await asyncio.to_thread(time.sleep, CHECKPOINT_SECONDS)
+        out.extend(vectors)
+    return out, pipeline
+
+async def main():
+    texts = [f"chunk {i} " + "x" * (i % 50) for i in range(CHUNKS)]
+    expected = [[float(len(t))] * DIM for t in texts]
+
+    servers = SimulatedServers(SERVERS)
+    t0 = time.monotonic()
+    result = await sequential(texts, servers)
+    seq_seconds = time.monotonic() - t0
+    assert result == expected
+    print(f"sequential: {CHUNKS / seq_seconds:7.1f} chunks/s, servers busy {servers.busy / (seq_seconds * SERVERS):.0%}")
+
+    servers = SimulatedServers(SERVERS)
+    t0 = time.monotonic()
+    result, pipeline = await pipelined(texts, servers)
+    pipe_seconds = time.monotonic() - t0
+    assert result == expected, "pipeline returned vectors out of order"
+    print(f"pipelined:  {CHUNKS / pipe_seconds:7.1f} chunks/s, servers busy {servers.busy / (pipe_seconds * SERVERS):.0%}"
+          f"  (final batch size {pipeline.batch_size}, {pipeline.requests} requests)")
+    print(f"speedup: {seq_seconds / pipe_seconds:.2f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
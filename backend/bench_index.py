@@ -0,0 +1,55 @@
+"""
+Compares flat, HNSW and IVF indexes on synthetic clustered vectors:
+build time, query latency and recall@k against exact search.
+
+    python bench_index.py [n_vectors] [dim]
+"""
+import sys
+import time
+
+import numpy as np
+
+from index_types import build_index, search_params
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+DIM = int(sys.argv[2]) if len(sys.argv) > 2 else 768
+K = 25
+QUERIES = 200
+
+def make_vectors(n, dim, rng):
+    # Clustered data behaves much more like real embeddings than uniform noise
+    centers = rng.standard_normal((max(n // 500, 1), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), n)
+    return centers[labels] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+
+def run(index, queries, truth, **knobs):
+    params = search_params(index, k=K, **knobs)
+    latencies, hits = [], 0
+    for q, expected in zip(queries, truth):
+        t0 = time.perf_counter()
+        _, rows = index.search(q[None, :], K, params=params)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        hits += len(set(rows[0]) & set(expected))
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"  {str(knobs or 'exact'):<22} p50 {p50:6.2f} ms   p99 {p99:6.2f} ms   recall@{K} {hits / (len(queries) * K):.3f}")
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"Generating {N} x {DIM} vectors...")
+    vectors = make_vectors(N, DIM, rng)
+    queries = vectors[rng.choice(N, QUERIES, replace=False)] + 0.05 * rng.standard_normal((QUERIES, DIM)).astype(np.float32)
+
+    flat = build_index(vectors, "flat")
+    _, truth = flat.search(queries, K)
+
+    print("flat")
+    run(flat, queries, truth)
+
+    for kind, knob, values in (("hnsw", "ef_search", (32, 64, 128)), ("ivf", "nprobe", (4, 16, 64))):
+        t0 = time.time()
+        index = build_index(vectors, kind)
+        print(f"{kind} (built in {time.time() - t0:.1f}s)")
+        for value in values:
+            run(index, queries, truth, **{knob: value})
@@ -0,0 +1,56 @@
+"""
+Memory saved and recall lost by SQ8 / PQ compressed indexes, with and without
+exact re-ranking, relative to the flat float32 index.
+
+    python bench_quantization.py [n_vectors] [dim]
+"""
+import sys
+import time
+
+import faiss
+import numpy as np
+
+from bench_index import make_vectors
+from index_types import build_index, exact_rerank
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+DIM = int(sys.argv[2]) if len(sys.argv) > 2 else 768
+K = 25
+QUERIES = 200
+RERANK_FACTORS = (1, 4, 10)
+
+def evaluate(index, vectors, queries, truth, rerank_factor):
+    hits, latencies = 0, []
+    for q, expected in zip(queries, truth):
+        t0 = time.perf_counter()
+        if rerank_factor:
+            _, rows = index.search(q[None, :], K * rerank_factor)
+            _, rows = exact_rerank(vectors, q, rows[0])
+            rows = rows[:K]
+        else:
+            _, rows = index.search(q[None, :], K)
+            rows = rows[0]
+        latencies.append((time.perf_counter() - t0) * 1000)
+        hits += len(set(rows) & set(expected))
+    return hits / (len(queries) * K), sorted(latencies)[len(latencies) // 2]
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"Generating {N} x {DIM} vectors...")
+    vectors = make_vectors(N, DIM, rng)
+    queries = vectors[rng.choice(N, QUERIES, replace=False)] + 0.05 * rng.standard_normal((QUERIES, DIM)).astype(np.float32)
+
+    flat = build_index(vectors, "flat", "none")
+    flat_bytes = faiss.serialize_index(flat).nbytes
+    _, truth = flat.search(queries, K)
+    print(f"flat float32: {flat_bytes / 2**20:.1f} MB")
+
+    for quantization in ("sq8", "pq"):
+        index = build_index(vectors, "flat", quantization)
+        nbytes = faiss.serialize_index(index).nbytes
+        print(f"{quantization}: {nbytes / 2**20:.1f} MB ({100 * (1 - nbytes / flat_bytes):.1f}% less than flat)")
+        recall, p50 = evaluate(index, vectors, queries, truth, 0)
+        print(f"  no re-rank        recall@{K} {recall:.3f} (lost {1 - recall:.3f})   p50 {p50:.2f} ms")
+        for factor in RERANK_FACTORS:
+            recall, p50 = evaluate(index, vectors, queries, truth, factor)
+            print(f"  re-rank {factor:>2} x k    recall@{K} {recall:.3f} (lost {1 - recall:.3f})   p50 {p50:.2f} ms")
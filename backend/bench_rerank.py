@@ -0,0 +1,67 @@
+"""
+Times the post-retrieval stages on synthetic candidates: the vectorized
+MMR in reranking.py against a straightforward per-document Python loop,
+for k candidates -> top passages.
+
+    python bench_rerank.py [candidates] [dim] [top]
+"""
+import sys
+import time
+
+import numpy as np
+
+from reranking import PostRetrieval, mmr
+
+CANDIDATES = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+DIM = int(sys.argv[2]) if len(sys.argv) > 2 else 768
+TOP = int(sys.argv[3]) if len(sys.argv) > 3 else 15
+RUNS = 500
+BUDGET_MS = 5.0
+
+def loop_mmr(query, vectors, relevance, k, lambda_mult=0.7):
+    """Reference implementation: one Python iteration per candidate per pick."""
+    def cosine(a, b):
+        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+    relevance = relevance / np.abs(relevance).max()
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < k:
+        best, best_score = None, -np.inf
+        for i in range(len(vectors)):
+            if i in selected:
+                continue
+            redundancy = max(cosine(vectors[i], vectors[j]) for j in selected)
+            score = lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        selected.append(best)
+    return np.array(selected)
+
+def time_ms(fn, runs):
+    latencies = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - t0) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    # A few tight clusters of near-duplicates, like overlapping chunks of the same pages
+    centers = rng.standard_normal((CANDIDATES // 5, DIM)).astype(np.float32)
+    labels = rng.integers(0, len(centers), CANDIDATES)
+    vectors = centers[labels] + 0.1 * rng.standard_normal((CANDIDATES, DIM)).astype(np.float32)
+    query = vectors[0] + 0.5 * rng.standard_normal(DIM).astype(np.float32)
+    relevance = np.sort(rng.random(CANDIDATES).astype(np.float32))[::-1]
+
+    fast = mmr(query, vectors, relevance, TOP)
+    slow = loop_mmr(query, vectors, relevance, TOP)
+    print(f"{CANDIDATES} candidates x {DIM} dims -> top {TOP}   (same selection as the loop: {np.array_equal(fast, slow)})")
+    print(f"distinct clusters in the top {TOP}: by relevance {len(set(labels[:TOP]))}, mmr {len(set(labels[fast]))}")
+
+    pipeline = PostRetrieval("threshold,mmr")
+    p50, p99 = time_ms(lambda: pipeline(query, vectors, relevance, TOP), RUNS)
+    print(f"  vectorized pipeline  p50 {p50:7.3f} ms   p99 {p99:7.3f} ms")
+    loop_p50, loop_p99 = time_ms(lambda: loop_mmr(query, vectors, relevance, TOP), max(RUNS // 50, 3))
+    print(f"  python loop mmr      p50 {loop_p50:7.3f} ms   p99 {loop_p99:7.3f} ms")
+    print(f"{'PASS' if p99 < BUDGET_MS else 'FAIL'}: p99 {p99:.3f} ms (budget {BUDGET_MS} ms)")
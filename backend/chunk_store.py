@@ -0,0 +1,169 @@
+"""
+Compact, non-pickle store for chunk text and metadata.
+
+Each index segment has one SQLite file with a row per chunk, keyed by the
+chunk's FAISS row id. source and page are real columns (source is indexed,
+so deleting a file doesn't scan every chunk); any other metadata is kept as
+JSON. Lookups fetch only the requested rows, so a query materialises just
+its top-k chunks as Python objects.
+
+The same file holds the segment's keyword index: a postings table of
+(term, row, term frequency) plus each chunk's length in tokens, used for
+BM25 scoring (see lexical.py).
+"""
+import os
+import json
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from lexical import term_frequencies
+
+# Rows inserted per executemany() while writing
+WRITE_BATCH = 1000
+
+class ChunkStore:
+    """Read-only view of one segment's chunk records. Segment.load() opens it; otherwise it opens on first lookup."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._lexical_stats = None
+
+    @staticmethod
+    def write(path: str, docs: Iterable[Document]):
+        """Writes docs (row i = i-th doc) to a new store at path, via a temp file + rename."""
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("""
+                CREATE TABLE chunks (
+                    row INTEGER PRIMARY KEY,
+                    id TEXT NOT NULL,
+                    source TEXT,
+                    page INTEGER,
+                    text TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    length INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE postings (
+                    term TEXT NOT NULL,
+                    row INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term, row)
+                ) WITHOUT ROWID
+            """)
+            chunk_rows, posting_rows = [], []
+            for row, doc in enumerate(docs):
+                counts, length = term_frequencies(doc.page_content)
+                chunk_rows.append(_to_row(row, doc) + (length,))
+                posting_rows.extend((term, row, tf) for term, tf in counts.items())
+                if len(chunk_rows) >= WRITE_BATCH:
+                    _insert(conn, chunk_rows, posting_rows)
+                    chunk_rows, posting_rows = [], []
+            _insert(conn, chunk_rows, posting_rows)
+            conn.execute("CREATE INDEX idx_chunks_source ON chunks (source)")
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp, path)
+
+    def _connect(self):
+        with self._lock:
+            if self._conn is None:
+                # immutable=1: the file never changes once written, so SQLite skips locking
+                self._conn = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        return self._conn
+
+    def open(self):
+        """Opens the connection now rather than on first lookup."""
+        self._conn or self._connect()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get_many(self, rows: List[int]) -> Dict[int, Document]:
+        """Fetches the given rows. Returns {row: Document}."""
+        conn = self._conn or self._connect()
+        placeholders = ",".join("?" * len(rows))
+        with self._lock:
+            records = conn.execute(
+                f"SELECT row, id, source, page, text, metadata FROM chunks WHERE row IN ({placeholders})",
+                [int(r) for r in rows],
+            ).fetchall()
+        return {record[0]: _to_doc(record) for record in records}
+
+    def rows_for_source(self, source: str) -> List[int]:
+        conn = self._conn or self._connect()
+        with self._lock:
+            return [r for (r,) in conn.execute("SELECT row FROM chunks WHERE source = ?", (source,))]
+
+    def lexical_stats(self) -> Tuple[int, int]:
+        """(number of chunks, total length in tokens). The file is immutable, so this is cached."""
+        if self._lexical_stats is None:
+            conn = self._conn or self._connect()
+            with self._lock:
+                count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+            self._lexical_stats = (count, total)
+        return self._lexical_stats
+
+    def postings(self, terms: List[str]) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Returns {term: (rows, term frequencies, chunk lengths)} for the terms that occur here."""
+        conn = self._conn or self._connect()
+        placeholders = ",".join("?" * len(terms))
+        with self._lock:
+            records = conn.execute(
+                f"SELECT p.term, p.row, p.tf, c.length FROM postings p JOIN chunks c ON c.row = p.row "
+                f"WHERE p.term IN ({placeholders})",
+                terms,
+            ).fetchall()
+        by_term = {}
+        for term, row, tf, length in records:
+            by_term.setdefault(term, []).append((row, tf, length))
+        result = {}
+        for term, entries in by_term.items():
+            rows, tf, lengths = zip(*entries)
+            result[term] = (np.array(rows, dtype=np.int64), np.array(tf, dtype=np.float32), np.array(lengths, dtype=np.float32))
+        return result
+
+    def iter_docs(self):
+        """Yields every Document in row order (for compaction)."""
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True)
+        try:
+            for record in conn.execute("SELECT row, id, source, page, text, metadata FROM chunks ORDER BY row"):
+                yield _to_doc(record)
+        finally:
+            conn.close()
+
+def _insert(conn, chunk_rows, posting_rows):
+    conn.executemany(
+        "INSERT INTO chunks (row, id, source, page, text, metadata, length) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        chunk_rows,
+    )
+    conn.executemany("INSERT INTO postings (term, row, tf) VALUES (?, ?, ?)", posting_rows)
+
+def _to_row(row: int, doc: Document):
+    extra = {k: v for k, v in doc.metadata.items() if k not in ("source", "page")}
+    return (row, doc.id, doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content, json.dumps(extra))
+
+def _to_doc(record) -> Document:
+    _, doc_id, source, page, text, extra = record
+    metadata = {}
+    if source is not None:
+        metadata["source"] = source
+    if page is not None:
+        metadata["page"] = page
+    metadata.update(json.loads(extra))
+    return Document(id=doc_id, page_content=text, metadata=metadata)
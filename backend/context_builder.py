@@ -0,0 +1,181 @@
+"""
+Packs retrieved passages into the SOURCE MATERIAL section of the prompt.
+
+Chunks are split with CHUNK_OVERLAP characters of overlap, so neighbouring
+chunks of one page that are both retrieved repeat text, and the same passage
+can appear twice (a re-uploaded edition, a repeated preface). Prompt
+evaluation dominates latency on CPU-only Ollama, so every repeated token
+costs time. The builder:
+
+  1. merges chunks of the same source and page that overlap or are adjacent
+     into one block. It uses the chunk's start_index when ingestion recorded
+     it, and otherwise finds the overlap in the text itself;
+  2. drops blocks that are near-duplicates of a better-ranked block
+     (word-shingle Jaccard similarity);
+  3. fills CONTEXT_TOKEN_BUDGET with blocks in retrieval score order, skipping
+     blocks that no longer fit.
+
+Blocks keep the "[source, p.N]:" header the prompt and citations rely on.
+Token counts are estimated from character counts, since Ollama's tokenizer
+isn't available here.
+"""
+import os
+import re
+from typing import List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Rough average for English text with Mistral/Llama-style tokenizers
+CHARS_PER_TOKEN = 4
+NEAR_DUPLICATE_JACCARD = 0.85
+# Shortest text overlap taken as a real continuation rather than a coincidence
+MIN_TEXT_OVERLAP = 20
+# Longest overlap looked for (a bit more than the splitter's CHUNK_OVERLAP)
+MAX_TEXT_OVERLAP = 400
+# Chunks whose spans are at most this far apart (the separator the splitter dropped) are adjacent
+ADJACENT_GAP = 2
+SEPARATOR = "\n\n---\n\n"
+
+_WORD = re.compile(r"\w+")
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def passage_header(doc: Document) -> str:
+    return f"[{doc.metadata.get('source', 'Unknown')}, p.{doc.metadata.get('page', 0) + 1}]"
+
+class Block:
+    """Text from one source page, made of one or more merged chunks."""
+
+    def __init__(self, doc: Document, rank: int):
+        self.doc = doc
+        self.text = doc.page_content
+        start = doc.metadata.get("start_index")
+        self.start = start if isinstance(start, int) and start >= 0 else None
+        self.end = self.start + len(self.text) if self.start is not None else None
+        self.rank = rank  # best (lowest) retrieval rank among the merged chunks
+        self.chunks = 1
+
+    @property
+    def key(self):
+        return self.doc.metadata.get("source"), self.doc.metadata.get("page")
+
+    def absorb(self, other: "Block", text: str, start: Optional[int], end: Optional[int]):
+        self.text = text
+        self.start, self.end = start, end
+        self.rank = min(self.rank, other.rank)
+        self.chunks += other.chunks
+
+def _suffix_prefix_overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of a that is a prefix of b (0 if below MIN_TEXT_OVERLAP)."""
+    if len(a) < MIN_TEXT_OVERLAP or len(b) < MIN_TEXT_OVERLAP:
+        return 0
+    tail_start = max(0, len(a) - MAX_TEXT_OVERLAP)
+    probe = b[:MIN_TEXT_OVERLAP]
+    position = a.find(probe, tail_start)
+    while position != -1:
+        if b.startswith(a[position:]):
+            return len(a) - position
+        position = a.find(probe, position + 1)
+    return 0
+
+def _merge(a: Block, b: Block) -> bool:
+    """Merges b into a if they are the same page and overlap, touch or contain one another."""
+    if a.key != b.key:
+        return False
+    if a.start is not None and b.start is not None:
+        first, second = (a, b) if a.start <= b.start else (b, a)
+        if second.start > first.end + ADJACENT_GAP:
+            return False
+        if second.end <= first.end:
+            text = first.text
+        elif second.start >= first.end:
+            text = first.text + "\n" + second.text
+        else:
+            text = first.text + second.text[first.end - second.start:]
+        a.absorb(b, text, first.start, max(first.end, second.end))
+        return True
+
+    # No recorded offsets (chunks ingested before start_index was stored): look at the text
+    if b.text in a.text:
+        a.absorb(b, a.text, a.start, a.end)
+        return True
+    if a.text in b.text:
+        a.absorb(b, b.text, b.start, b.end)
+        return True
+    n = _suffix_prefix_overlap(a.text, b.text)
+    if n:
+        a.absorb(b, a.text + b.text[n:], None, None)
+        return True
+    n = _suffix_prefix_overlap(b.text, a.text)
+    if n:
+        a.absorb(b, b.text + a.text[n:], None, None)
+        return True
+    return False
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / max(len(a | b), 1)
+
+def merge_passages(docs: List[Document]) -> List[Block]:
+    """Merges and de-duplicates docs (best first). Returns blocks ordered by their best rank."""
+    blocks = []
+    for rank, doc in enumerate(docs):
+        block = Block(doc, rank)
+        # A new chunk can bridge two existing blocks, so keep merging until nothing changes
+        merged = True
+        while merged:
+            merged = False
+            for i, existing in enumerate(blocks):
+                if _merge(existing, block):
+                    block = blocks.pop(i)
+                    merged = True
+                    break
+        blocks.append(block)
+    blocks.sort(key=lambda b: b.rank)
+
+    kept, kept_shingles = [], []
+    for block in blocks:
+        shingles = _shingles(block.text)
+        if any(_jaccard(shingles, other) >= NEAR_DUPLICATE_JACCARD for other in kept_shingles):
+            continue
+        kept.append(block)
+        kept_shingles.append(shingles)
+    return kept
+
+def build_context(docs: List[Document], token_budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, dict]:
+    """
+    Returns (context, stats) for docs ordered best first. stats has the
+    passage and block counts and the estimated tokens before and after.
+    """
+    naive = SEPARATOR.join(f"{passage_header(d)}:\n{d.page_content}" for d in docs)
+    blocks = merge_passages(docs)
+
+    parts, used = [], 0
+    for block in blocks:
+        part = f"{passage_header(block.doc)}:\n{block.text}"
+        cost = estimate_tokens(part + SEPARATOR)
+        if used + cost > token_budget:
+            if parts:
+                continue  # a smaller, lower-ranked block may still fit
+            # Never send an empty context: trim the best block to the budget
+            part = part[:max(token_budget * CHARS_PER_TOKEN - len(SEPARATOR), 0)]
+            cost = estimate_tokens(part + SEPARATOR)
+        parts.append(part)
+        used += cost
+
+    context = SEPARATOR.join(parts)
+    stats = {
+        "passages": len(docs),
+        "blocks": len(blocks),
+        "blocks_used": len(parts),
+        "tokens_before": estimate_tokens(naive),
+        "tokens_after": estimate_tokens(context),
+    }
+    return context, stats
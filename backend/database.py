@@ -1,8 +1,14 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager
 import os
 
+try:
+    import fcntl
+except ImportError:  # Windows: single worker only
+    fcntl = None
+
 # Database URL - using SQLite for development, can switch to PostgreSQL for production
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./rag_app.db")
 
@@ -18,6 +24,83 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+def add_missing_columns():
+    """
+    create_all() only creates missing tables, it never alters existing ones.
+    Add columns that were introduced after a table was created so existing
+    development databases keep working.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(engine.dialect)
+                    # Existing rows get a numeric default too, rather than NULL
+                    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                    if isinstance(default, (int, float)):
+                        col_type += f" DEFAULT {default:d}" if isinstance(default, int) else f" DEFAULT {default}"
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+            # Nor does it create indexes on existing tables (e.g. for a column added above)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+def relax_not_null_columns():
+    """
+    Makes columns that became nullable in the models (e.g. documents.user_id, for
+    anonymous uploads) nullable in existing databases too. SQLite can't alter a
+    column, so the table is rebuilt from the model and its rows copied over.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"]: c for c in inspector.get_columns(table.name)}
+        relaxed = [c.name for c in table.columns
+                   if c.nullable and c.name in existing and not existing[c.name]["nullable"]]
+        if not relaxed:
+            continue
+        print(f"Migrating {table.name}: making {', '.join(relaxed)} nullable")
+        with engine.begin() as conn:
+            if engine.dialect.name != "sqlite":
+                for name in relaxed:
+                    conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {name} DROP NOT NULL"))
+                continue
+            old = f"{table.name}_old"
+            for index in inspector.get_indexes(table.name):
+                conn.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+            conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {old}"))
+            table.create(conn)  # with its indexes
+            columns = ", ".join(c.name for c in table.columns if c.name in existing)
+            conn.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old}"))
+            conn.execute(text(f"DROP TABLE {old}"))
+
+@contextmanager
+def schema_lock(path: str = os.path.join("data", "schema.lock")):
+    """
+    Serializes schema setup across worker processes: with --workers N they all
+    start at once, and on a fresh database create_all() would race itself.
+    """
+    with process_lock(path):
+        yield
+
+@contextmanager
+def process_lock(path: str):
+    """Exclusive lock on path, held across worker processes (a no-op without fcntl)."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
 # Dependency to get DB session
 def get_db():
     db = SessionLocal()
@@ -1,5 +1,6 @@
 from langchain_ollama import ChatOllama, OllamaEmbeddings
-from langchain_community.vectorstores import FAISS
+from index_store import SegmentedIndex
+from context_builder import build_context
 import os
 
 INDEX_FOLDER = "faiss_index"
@@ -7,20 +8,15 @@ INDEX_FOLDER = "faiss_index"
 def test_chat(question):
     print("Loading index...")
     embeddings = OllamaEmbeddings(model="nomic-embed-text")
-    vector_db = FAISS.load_local(INDEX_FOLDER, embeddings, allow_dangerous_deserialization=True)
+    vector_db = SegmentedIndex.open(INDEX_FOLDER, embeddings, compact_in_background=False)
     
     # Retrieve
     print(f"Retrieving for query: '{question}'")
-    docs_and_scores = vector_db.similarity_search_with_score(question, k=40)
+    docs_and_scores = vector_db.hybrid_search_with_score(question, k=15)
     source_docs = [doc for doc, score in docs_and_scores]
     
-    context_parts = []
-    for d in source_docs:
-        src = d.metadata.get("source", "Unknown")
-        pg = d.metadata.get("page", 0) + 1
-        context_parts.append(f"[{src}, p.{pg}]:\n{d.page_content}")
-    context = "\n\n".join(context_parts)
-    print(f"Context length: {len(context)}")
+    context, stats = build_context(source_docs)
+    print(f"Context length: {len(context)} ({stats})")
 
     # Prompt
     prompt = f"""You are an expert research assistant.
@@ -1,5 +1,5 @@
 from langchain_ollama import OllamaEmbeddings
-from langchain_community.vectorstores import FAISS
+from index_store import SegmentedIndex
 import os
 
 INDEX_FOLDER = "faiss_index"
@@ -12,7 +12,7 @@ def test_faiss():
     print("Loading index...")
     try:
         embeddings = OllamaEmbeddings(model="nomic-embed-text")
-        vector_db = FAISS.load_local(INDEX_FOLDER, embeddings, allow_dangerous_deserialization=True)
+        vector_db = SegmentedIndex.open(INDEX_FOLDER, embeddings, compact_in_background=False)
         print("Index loaded.")
         
         print("Testing search...")
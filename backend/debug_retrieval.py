@@ -1,22 +1,22 @@
 
-from langchain_community.vectorstores import FAISS
+from index_store import SegmentedIndex
 from langchain_ollama import OllamaEmbeddings
 import os
 
 INDEX_FOLDER = "faiss_index"
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 
-def debug_retrieval(query, k=35):
+def debug_retrieval(query, k=15, baseline_k=35):
     if not os.path.exists(INDEX_FOLDER):
         print("No index found.")
         return
 
     print(f"Loading index from {INDEX_FOLDER}...")
     embeddings = OllamaEmbeddings(model="nomic-embed-text", base_url=OLLAMA_BASE_URL)
-    vector_db = FAISS.load_local(INDEX_FOLDER, embeddings, allow_dangerous_deserialization=True)
+    vector_db = SegmentedIndex.open(INDEX_FOLDER, embeddings, compact_in_background=False)
     
-    print(f"Searching for: '{query}' with k={k}")
-    docs_and_scores = vector_db.similarity_search_with_score(query, k=k)
+    print(f"Searching for: '{query}' with k={k} (hybrid)")
+    docs_and_scores = vector_db.hybrid_search_with_score(query, k=k)
     
     print(f"\nFound {len(docs_and_scores)} documents:\n")
     for i, (doc, score) in enumerate(docs_and_scores, 1):
@@ -27,5 +27,13 @@ def debug_retrieval(query, k=35):
         print(f"Content Preview: {doc.page_content[:200]}...")
         print("-" * 50)
 
+    # Compare with the old vector-only retrieval at a larger k
+    keyword_ids = {doc.id for doc, _ in vector_db.keyword_search_with_score(query, k=k)}
+    vector_ids = {doc.id for doc, _ in vector_db.similarity_search_with_score(query, k=baseline_k)}
+    hybrid_ids = {doc.id for doc, _ in docs_and_scores}
+    print(f"Vector-only k={baseline_k} passages also in hybrid k={k}: {len(vector_ids & hybrid_ids)}")
+    print(f"Hybrid passages that vector-only k={baseline_k} missed: {len(hybrid_ids - vector_ids)} "
+          f"({len((hybrid_ids - vector_ids) & keyword_ids)} from keyword matches)")
+
 if __name__ == "__main__":
     debug_retrieval("What quranic evidences are provided on the death of Isa and not on the cross and not his bodily ascension?")
@@ -0,0 +1,173 @@
+"""
+Content-addressed, on-disk embedding cache.
+
+Vectors are stored in SQLite keyed by (model name, sha256 of the chunk text),
+so re-uploads, new editions that share pages and index rebuilds only send
+cache misses to Ollama. The cache is bounded by entry count and evicts the
+least recently used vectors first.
+"""
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+# ~3 KB per 768-dim vector, so 500k entries is roughly 1.5 GB on disk
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """SQLite-backed store of embedding vectors with LRU eviction and hit/miss counters."""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, hashes: List[str]) -> dict:
+        """Returns {hash: vector} for the hashes that are cached, and marks them as recently used."""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+            hit_count = sum(1 for h in hashes if h in found)
+            self.hits += hit_count
+            self.misses += len(hashes) - hit_count
+        return found
+
+    def put_many(self, model: str, items: dict):
+        """Stores {hash: vector} and evicts the least recently used entries if over capacity."""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, h, np.asarray(v, dtype=np.float32).tobytes(), now) for h, v in items.items()],
+            )
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                # Evict down to 90% so we don't pay for an eviction on every insert
+                excess = self._count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._count -= excess
+                self.evictions += excess
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model so document embeddings are served from an EmbeddingCache.
+    Only cache misses are sent to the underlying model. Queries go through query_embedder
+    (a QueryEmbedder, see query_embedder.py) if given, else straight to the model.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache: EmbeddingCache = None, query_embedder=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache or EmbeddingCache()
+        self.query_embedder = query_embedder
+
+    @staticmethod
+    def _missing(hashes: List[str], texts: List[str], vectors: dict) -> dict:
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in vectors:
+                missing.setdefault(h, t)
+        return missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        vectors = self.cache.get_many(self.model_name, hashes)
+
+        missing = self._missing(hashes, texts, vectors)
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), new_vectors))
+            self.cache.put_many(self.model_name, computed)
+            vectors.update(computed)
+
+        return [vectors[h] for h in hashes]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        vectors = await asyncio.to_thread(self.cache.get_many, self.model_name, hashes)
+
+        missing = self._missing(hashes, texts, vectors)
+        if missing:
+            new_vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), new_vectors))
+            await asyncio.to_thread(self.cache.put_many, self.model_name, computed)
+            vectors.update(computed)
+
+        return [vectors[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.query_embedder is not None:
+            return self.query_embedder.embed_query(text)
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.query_embedder is not None:
+            return await self.query_embedder.aembed_query(text)
+        return await self.embeddings.aembed_query(text)
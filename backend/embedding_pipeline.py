@@ -0,0 +1,121 @@
+"""
+Pipelined embedding for ingestion.
+
+Embedding batches one after another leaves Ollama idle while the job
+checkpoints a batch, and leaves the job idle while Ollama works. Instead, up
+to INGEST_EMBED_IN_FLIGHT batches are embedded concurrently. By default that
+is two per embedding server, so each server always has its next batch queued
+behind the current one. Results are handed out strictly in input order, so
+the checkpoint (and the index) receive vectors in chunk order even when
+batches complete out of order.
+
+The window counts batches that have been started but not yet handed out, so
+a slow batch at the head stalls new requests instead of letting finished ones
+pile up. At most INGEST_EMBED_IN_FLIGHT x INGEST_BATCH_MAX texts and their
+vectors are held at any time.
+
+Batch size adapts to the observed latency. It starts at INGEST_BATCH_SIZE
+and moves towards the size at which one request takes about
+INGEST_TARGET_BATCH_SECONDS, growing at most 2x per batch and staying within
+[INGEST_BATCH_MIN, INGEST_BATCH_MAX]. Fast servers (or cache hits) get large,
+cheap-to-dispatch batches. Slow ones get small batches, which keeps progress
+and checkpoints frequent and makes a retried request cheap.
+"""
+import os
+import time
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+# 0: two per embedding server
+INGEST_EMBED_IN_FLIGHT = int(os.getenv("INGEST_EMBED_IN_FLIGHT", "0"))
+INGEST_BATCH_MIN = int(os.getenv("INGEST_BATCH_MIN", "16"))
+INGEST_BATCH_MAX = int(os.getenv("INGEST_BATCH_MAX", "512"))
+INGEST_TARGET_BATCH_SECONDS = float(os.getenv("INGEST_TARGET_BATCH_SECONDS", "2"))
+EWMA_ALPHA = 0.3
+
+EmbedFn = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+async def _aiter(texts):
+    if hasattr(texts, "__aiter__"):
+        async for text in texts:
+            yield text
+    else:
+        for text in texts:
+            yield text
+
+class EmbeddingPipeline:
+    def __init__(self, embed: EmbedFn, in_flight: int, batch_size: int,
+                 min_batch: int = INGEST_BATCH_MIN, max_batch: int = INGEST_BATCH_MAX,
+                 target_seconds: float = INGEST_TARGET_BATCH_SECONDS):
+        self.embed_fn = embed
+        self.in_flight = max(1, in_flight)
+        self.min_batch = max(1, min_batch)
+        self.max_batch = max(self.min_batch, max_batch)
+        self.batch_size = min(max(batch_size, self.min_batch), self.max_batch)
+        self.target_seconds = target_seconds
+        self.seconds_per_text: Optional[float] = None  # EWMA of request latency / batch size
+        self.requests = 0
+        self.texts = 0
+        self.busy_seconds = 0.0  # sum of request latencies
+        self.started_at = None
+
+    def _observe(self, count: int, seconds: float):
+        self.requests += 1
+        self.texts += count
+        self.busy_seconds += seconds
+        sample = seconds / count
+        if self.seconds_per_text is None:
+            self.seconds_per_text = sample
+        else:
+            self.seconds_per_text += EWMA_ALPHA * (sample - self.seconds_per_text)
+        wanted = self.target_seconds / max(self.seconds_per_text, 1e-6)
+        self.batch_size = int(min(max(wanted, self.min_batch), self.max_batch, self.batch_size * 2))
+
+    async def _embed(self, texts: List[str]) -> List[List[float]]:
+        t0 = time.monotonic()
+        vectors = await self.embed_fn(texts)
+        self._observe(len(texts), time.monotonic() - t0)
+        return vectors
+
+    async def embed(self, texts) -> AsyncIterator[List[List[float]]]:
+        """
+        Embeds texts (a sequence, iterable or async iterable, read lazily) and yields
+        their vectors batch by batch, in input order. Stopping early cancels the
+        requests still running.
+        """
+        source = _aiter(texts)
+        pending = deque()  # tasks, in input order
+        exhausted = False
+        self.started_at = self.started_at or time.monotonic()
+        try:
+            while True:
+                while not exhausted and len(pending) < self.in_flight:
+                    batch = []
+                    async for text in source:
+                        batch.append(text)
+                        if len(batch) >= self.batch_size:
+                            break
+                    if len(batch) < self.batch_size:
+                        exhausted = True
+                    if batch:
+                        pending.append(asyncio.ensure_future(self._embed(batch)))
+                if not pending:
+                    return
+                vectors = await pending[0]
+                pending.popleft()
+                yield vectors
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "requests": self.requests,
+            "texts": self.texts,
+            "batch_size": self.batch_size,
+            "in_flight": self.in_flight,
+            "texts_per_second": round(self.texts / elapsed, 1) if elapsed else 0.0,
+            "avg_request_seconds": round(self.busy_seconds / self.requests, 3) if self.requests else 0.0,
+        }
@@ -0,0 +1,52 @@
+"""
+Dedicated, bounded thread pool for the CPU-bound parts of a chat request.
+
+Retrieval (FAISS search, BM25 scoring, chunk lookups) and answer-cache
+lookups run here instead of on the event loop or in FastAPI's default
+threadpool. The pool has a fixed number of workers, and at most max_pending
+calls may be queued or running. Callers beyond that wait asynchronously for
+a slot, so a burst of chats queues up without blocking the loop or growing
+memory without limit. FAISS releases the GIL while searching, so the workers
+run in parallel.
+"""
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", str(os.cpu_count() or 1)))
+RETRIEVAL_MAX_PENDING = int(os.getenv("RETRIEVAL_MAX_PENDING", str(RETRIEVAL_WORKERS * 8)))
+
+class BoundedExecutor:
+    def __init__(self, workers: int, max_pending: int, name: str):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._slots = None
+        self.pending = 0
+        self.completed = 0
+
+    async def run(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) on the pool and awaits its result."""
+        if self._slots is None:
+            # Created on first use, inside the server's event loop
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            self.pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+            finally:
+                self.pending -= 1
+                self.completed += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
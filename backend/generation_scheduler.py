@@ -0,0 +1,185 @@
+"""
+Fair, bounded scheduler for LLM generation.
+
+Ollama serializes generation internally, so sending it every chat at once
+only moves the queue into Ollama, where nobody can see it and requests end
+in read timeouts. Instead, at most GENERATION_CONCURRENCY generations run at
+a time and the rest wait here. Waiting requests are queued per user and
+granted round-robin across users, so one user with many questions cannot
+starve everyone else. Each waiting request can report its position and an
+estimated wait, based on a moving average of recent generation times. When
+the queue is full (GENERATION_MAX_QUEUE overall, or
+GENERATION_MAX_QUEUED_PER_USER for one user), new requests are refused
+immediately with QueueFull, which carries a suggested Retry-After.
+
+The scheduler lives in one process. With WEB_CONCURRENCY workers, each one
+gets its share of these limits (per_worker), so together they send Ollama
+about GENERATION_CONCURRENCY generations at a time.
+
+All methods must be called from the event loop.
+"""
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from typing import Hashable, Optional
+
+# Ollama runs one generation at a time unless OLLAMA_NUM_PARALLEL is raised on its side.
+# These are totals across all worker processes; see per_worker().
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "1"))
+GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", "32"))
+GENERATION_MAX_QUEUED_PER_USER = int(os.getenv("GENERATION_MAX_QUEUED_PER_USER", "4"))
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Assumed generation time until real ones have been measured
+INITIAL_ESTIMATE_SECONDS = 20.0
+EWMA_ALPHA = 0.2
+
+def per_worker(total: int, workers: int = WEB_CONCURRENCY) -> int:
+    """This process's share of a limit split across worker processes, rounded down but at least 1."""
+    return max(1, total // workers)
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+class Ticket:
+    """One request's place in the scheduler: queued, then granted, then released."""
+
+    def __init__(self, user: Hashable, scheduler: "GenerationScheduler"):
+        self.user = user
+        self.scheduler = scheduler
+        self.granted = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+
+    def position(self) -> int:
+        """Requests that will be granted before this one (0 = next). 0 once granted."""
+        return self.scheduler.position(self)
+
+    def estimated_wait(self) -> float:
+        return 0.0 if self.granted.done() else self.scheduler.estimated_wait(self.position())
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits until granted, or at most timeout seconds. Returns whether it was granted."""
+        if not self.granted.done():
+            await asyncio.wait({self.granted}, timeout=timeout)
+        return self.granted.done()
+
+class GenerationScheduler:
+    def __init__(self, concurrency: int = GENERATION_CONCURRENCY, max_queue: int = GENERATION_MAX_QUEUE,
+                 max_queued_per_user: int = GENERATION_MAX_QUEUED_PER_USER):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        # user -> waiting tickets, oldest first. Key order is the round-robin order.
+        self._queues = OrderedDict()
+        self.queued = 0
+        self.active = 0
+        self.avg_generation_seconds = INITIAL_ESTIMATE_SECONDS
+        self.avg_wait_seconds = 0.0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, user: Hashable) -> Ticket:
+        """Queues a request for user (granted at once if a slot is free). Raises QueueFull."""
+        self.check_admission(user)
+        ticket = Ticket(user, self)
+        self._queues.setdefault(user, deque()).append(ticket)
+        self.queued += 1
+        self._dispatch()
+        return ticket
+
+    def check_admission(self, user: Hashable):
+        """Raises QueueFull if a request from user would be refused right now."""
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(self._retry_after(), "Server is busy, please retry shortly.")
+        waiting = self._queues.get(user)
+        if waiting is not None and len(waiting) >= self.max_queued_per_user:
+            self.rejected += 1
+            raise QueueFull(self._retry_after(), "Too many of your questions are already waiting.")
+
+    def release(self, ticket: Ticket, generation_seconds: Optional[float] = None):
+        """
+        Frees the ticket's slot, or removes it from the queue if it never got one. Safe to call once.
+        generation_seconds is given for a generation that completed; only those feed the wait
+        estimates (cache hits, errors and disconnects would skew them).
+        """
+        if ticket.granted.done():
+            if ticket.started_at is None:
+                return  # already released
+            ticket.started_at = None
+            self.active -= 1
+            if generation_seconds is not None:
+                self.completed += 1
+                self.avg_generation_seconds += EWMA_ALPHA * (generation_seconds - self.avg_generation_seconds)
+        else:
+            waiting = self._queues.get(ticket.user)
+            if waiting is not None and ticket in waiting:
+                waiting.remove(ticket)
+                self.queued -= 1
+                if not waiting:
+                    del self._queues[ticket.user]
+            ticket.granted.cancel()
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.active < self.concurrency and self._queues:
+            user, waiting = next(iter(self._queues.items()))
+            ticket = waiting.popleft()
+            self.queued -= 1
+            if waiting:
+                self._queues.move_to_end(user)  # back of the rotation
+            else:
+                del self._queues[user]
+            ticket.started_at = time.monotonic()
+            self.active += 1
+            self.avg_wait_seconds += EWMA_ALPHA * (ticket.started_at - ticket.enqueued_at - self.avg_wait_seconds)
+            ticket.granted.set_result(None)
+
+    def position(self, ticket: Ticket) -> int:
+        waiting = self._queues.get(ticket.user)
+        if waiting is None or ticket not in waiting:
+            return 0
+        # Round r grants the r-th waiting ticket of every user that has one, in rotation order
+        index = waiting.index(ticket)
+        position = 0
+        before = True
+        for user, others in self._queues.items():
+            if user == ticket.user:
+                before = False
+            position += min(len(others), index)
+            if before and len(others) > index:
+                position += 1
+        return position
+
+    def estimated_wait(self, position: Optional[int] = None) -> float:
+        """Seconds until the request at position is granted (default: a request submitted now)."""
+        if position is None:
+            if self.active < self.concurrency:
+                return 0.0
+            position = self.queued
+        return (position // self.concurrency + 1) * self.avg_generation_seconds
+
+    def _retry_after(self) -> int:
+        # Roughly when the next queued request will have been granted and a place freed up
+        return max(1, math.ceil(self.avg_generation_seconds / self.concurrency))
+
+    def waiting_for(self, user: Hashable) -> list:
+        return list(self._queues.get(user, ()))
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": self.queued,
+            "users_waiting": len(self._queues),
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_generation_seconds": round(self.avg_generation_seconds, 2),
+            "avg_wait_seconds": round(self.avg_wait_seconds, 2),
+            "estimated_wait_seconds": round(self.estimated_wait(), 1),
+        }
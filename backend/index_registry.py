@@ -0,0 +1,176 @@
+"""
+In-process LRU of opened vector indexes.
+
+Each user has their own index under data/users/<id>/vector_store (anonymous
+uploads share INDEX_FOLDER). Opened indexes are kept here, bounded by a
+memory budget and evicted when idle. Indexes that are in use (a search or an
+ingestion holds them through acquire()) are never evicted, so there is never
+more than one open SegmentedIndex writing to the same folder.
+
+With several worker processes, only the one for which is_writer() is true
+opens indexes as writers; the others open them read-only and follow the
+writer's manifest (see index_store.py).
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from index_store import SegmentedIndex
+
+INDEX_MEMORY_BUDGET_MB = int(os.getenv("INDEX_MEMORY_BUDGET_MB", "2048"))
+# Indexes unused for this long are closed
+INDEX_IDLE_SECONDS = float(os.getenv("INDEX_IDLE_SECONDS", "900"))
+
+class _Entry:
+    def __init__(self, index: SegmentedIndex):
+        self.index = index
+        self.pins = 0
+        self.last_used = time.time()
+
+class IndexRegistry:
+    def __init__(self, embeddings_factory, memory_budget_mb: int = INDEX_MEMORY_BUDGET_MB, idle_seconds: float = INDEX_IDLE_SECONDS,
+                 is_writer=lambda: True):
+        self.embeddings_factory = embeddings_factory
+        self.is_writer = is_writer
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.idle_seconds = idle_seconds
+        self._entries = OrderedDict()  # folder -> _Entry, least recently used first
+        self._lock = threading.Lock()
+        self._opening = {}  # folder -> Lock, so one folder is only opened once
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds_total = 0.0
+        self.load_seconds_max = 0.0
+        self._janitor = None
+
+    @contextmanager
+    def acquire(self, folder: str):
+        """Yields the opened index for folder, pinned (not evictable) for the duration."""
+        entry = self._pin(folder)
+        try:
+            yield entry.index
+        finally:
+            with self._lock:
+                entry.pins -= 1
+                entry.last_used = time.time()
+            self._evict_over_budget()
+
+    def _pin(self, folder: str) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(folder)
+            if entry is not None:
+                entry.pins += 1
+                self._entries.move_to_end(folder)
+                self.hits += 1
+                return entry
+            open_lock = self._opening.setdefault(folder, threading.Lock())
+
+        with open_lock:
+            with self._lock:
+                entry = self._entries.get(folder)
+                if entry is not None:
+                    entry.pins += 1
+                    self.hits += 1
+                    return entry
+            t0 = time.time()
+            index = SegmentedIndex.open(folder, self.embeddings_factory(), writer=self.is_writer())
+            elapsed = time.time() - t0
+            with self._lock:
+                entry = _Entry(index)
+                entry.pins = 1
+                self._entries[folder] = entry
+                self.loads += 1
+                self.load_seconds_total += elapsed
+                self.load_seconds_max = max(self.load_seconds_max, elapsed)
+            print(f"Opened index {folder} in {elapsed * 1000:.1f} ms")
+            return entry
+
+    def _evict(self, folder: str):
+        """Caller holds self._lock. Returns the entry to close once the lock is released."""
+        entry = self._entries.pop(folder)
+        self.evictions += 1
+        return folder, entry
+
+    def _close(self, victims):
+        for folder, entry in victims:
+            # Hold the folder's open lock so it can't be reopened while it is still closing
+            with self._opening.setdefault(folder, threading.Lock()):
+                entry.index.close()
+            print(f"Evicted index {folder}")
+
+    def _evict_over_budget(self):
+        victims = []
+        with self._lock:
+            total = sum(e.index.memory_bytes() for e in self._entries.values())
+            for folder in list(self._entries):
+                if total <= self.memory_budget:
+                    break
+                entry = self._entries[folder]
+                if entry.pins == 0:
+                    total -= entry.index.memory_bytes()
+                    victims.append(self._evict(folder))
+        self._close(victims)
+
+    def promote(self):
+        """Turns the open read-only indexes into writers, once this process has become the writer."""
+        with self._lock:
+            indexes = [entry.index for entry in self._entries.values()]
+        for index in indexes:
+            index.become_writer()
+
+    def evict_idle(self):
+        now = time.time()
+        victims = []
+        with self._lock:
+            for folder in list(self._entries):
+                entry = self._entries[folder]
+                if entry.pins == 0 and now - entry.last_used > self.idle_seconds:
+                    victims.append(self._evict(folder))
+        self._close(victims)
+
+    def start_janitor(self, interval: float = 60):
+        """Starts a background thread that closes idle indexes."""
+        if self._janitor is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    print(f"Index eviction failed: {e}")
+
+        self._janitor = threading.Thread(target=run, name="index-janitor", daemon=True)
+        self._janitor.start()
+
+    def metrics(self) -> dict:
+        now = time.time()
+        with self._lock:
+            resident = [
+                {
+                    "folder": folder,
+                    "chunks": len(entry.index),
+                    "bytes": entry.index.memory_bytes(),
+                    "version": entry.index.version,
+                    "writer": entry.index.writer,
+                    "reloads": entry.index.reloads,
+                    "snapshots": entry.index.live_snapshots,
+                    "pins": entry.pins,
+                    "idle_seconds": round(now - entry.last_used, 1),
+                }
+                for folder, entry in self._entries.items()
+            ]
+            return {
+                "resident": resident,
+                "resident_bytes": sum(r["bytes"] for r in resident),
+                "memory_budget_bytes": self.memory_budget,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "load_ms_avg": round(self.load_seconds_total / self.loads * 1000, 2) if self.loads else 0.0,
+                "load_ms_max": round(self.load_seconds_max * 1000, 2),
+            }
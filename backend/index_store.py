@@ -0,0 +1,829 @@
+"""
+Append-only, crash-safe vector index.
+
+The index is a folder of immutable segments plus a MANIFEST.json that lists
+the live segments and deleted rows:
+
+    MANIFEST.json          <- the only file that is ever rewritten (atomically)
+    seg-000001.faiss       <- FAISS index over the segment's vectors (flat, HNSW or IVF, see index_types.py)
+    seg-000001.npy         <- raw float32 vectors, used to rebuild during compaction and to re-rank quantized segments
+    seg-000001.chunks      <- chunk text + metadata by row id, and BM25 postings (SQLite, see chunk_store.py)
+
+An upload writes one new segment and then swaps in a new manifest with
+os.replace(), so its cost scales with the upload, not the library. A crash
+before the manifest swap leaves the old manifest in place; files it doesn't
+reference are removed on the next open. A background thread compacts in
+tiers: once COMPACT_MERGE_FACTOR segments of about the same size exist they
+are merged into one, so each chunk is rewritten only a logarithmic number of
+times as the library grows. Segments with many deleted rows are rewritten on
+their own.
+
+Readers never see a commit half-applied. Each commit publishes a new
+immutable Snapshot (segment list + deleted rows), and a search runs on
+whichever snapshot was current when it started, without taking a lock. New
+segments are written before the commit takes the write lock, so a long
+ingestion doesn't hold up deletes or compaction either. Snapshots are
+reference counted. Segments dropped by compaction stay open until the last
+snapshot using them is released, and only then are their files removed.
+
+Several worker processes can serve the same folder. Exactly one of them
+writes (see IngestionLock in ingestion_jobs.py); the others open the index
+with writer=False. Before handing out a snapshot, every process stats
+MANIFEST.json, whose version is the index's version marker, and reloads it
+when it has changed. Segments it already has open are reused and new ones
+are memory-mapped, so a reload costs about as much as the new segments'
+headers. A segment's files are opened as soon as it is loaded, so a writer
+removing a compacted segment never pulls files out from under a reader that
+still uses it.
+"""
+import os
+import json
+import math
+import uuid
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from chunk_store import ChunkStore
+from lexical import HYBRID_CANDIDATES, bm25_idf, bm25_scores, reciprocal_rank_fusion, tokenize
+from index_types import (
+    INDEX_RERANK_FACTOR, build_index, choose_index_type, choose_quantization,
+    exact_rerank, index_quantization, index_type, search_params,
+)
+
+MANIFEST = "MANIFEST.json"
+# Merge this many segments of the same size tier (sizes within this factor of each other)...
+COMPACT_MERGE_FACTOR = max(2, int(os.getenv("INDEX_COMPACT_MERGE_FACTOR", "4")))
+# ...or the smallest ones when there are more segments than this in total
+COMPACT_MAX_SEGMENTS = int(os.getenv("INDEX_COMPACT_MAX_SEGMENTS", "16"))
+# Rewrite a segment once this fraction of its rows is deleted
+COMPACT_MAX_DELETED = float(os.getenv("INDEX_COMPACT_MAX_DELETED", "0.2"))
+# Seconds between background compaction checks
+COMPACT_INTERVAL = float(os.getenv("INDEX_COMPACT_INTERVAL", "60"))
+# Manifest re-reads when the writer replaces segments while a reload is loading them
+RELOAD_ATTEMPTS = 5
+
+def _fsync_path(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _write_json_atomic(path: str, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_path(os.path.dirname(path) or ".")
+
+# Map index files instead of reading them: startup does no I/O up front and
+# every worker process serving the same index shares one copy in the page cache.
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+def read_index_mmap(path: str):
+    """Opens a FAISS index memory-mapped and read-only, falling back to a normal read."""
+    try:
+        return faiss.read_index(path, MMAP_FLAGS)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+class Segment:
+    """
+    One immutable segment: a FAISS index, its raw vectors and its chunk records.
+    load() memory-maps the index and vectors and opens the ChunkStore right away,
+    so the files stay readable after compaction removes them, and opening a
+    segment is still O(1).
+    """
+
+    def __init__(self, folder: str, name: str, index):
+        self.folder = folder
+        self.name = name
+        self.index = index
+        self.rows = index.ntotal
+        self._base = os.path.join(folder, name)
+        self.chunks = ChunkStore(self._base + ".chunks")
+        self.kind = index_type(index)
+        self.quantization = index_quantization(index)
+        self._vectors = None
+        self.nbytes = os.path.getsize(self._base + ".faiss")
+        self.retired = False  # dropped from the manifest by compaction
+        self._refs = 0  # live snapshots that include this segment
+
+    def __len__(self):
+        return self.rows
+
+    @staticmethod
+    def write(folder: str, name: str, vectors: np.ndarray, docs: Iterable[Document]) -> "Segment":
+        """Writes the segment files (each via tmp file + rename) and returns the opened segment."""
+        base = os.path.join(folder, name)
+        index = build_index(vectors)
+
+        faiss.write_index(index, base + ".faiss.tmp")
+        _fsync_path(base + ".faiss.tmp")
+        os.replace(base + ".faiss.tmp", base + ".faiss")
+
+        with open(base + ".npy.tmp", "wb") as f:
+            np.save(f, vectors)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(base + ".npy.tmp", base + ".npy")
+
+        ChunkStore.write(base + ".chunks", docs)
+        _fsync_path(base + ".chunks")
+
+        return Segment.load(folder, name)
+
+    @staticmethod
+    def load(folder: str, name: str) -> "Segment":
+        base = os.path.join(folder, name)
+        segment = Segment(folder, name, read_index_mmap(base + ".faiss"))
+        # Hold the files open (both are O(1)): another process may delete them once compacted
+        segment.chunks.open()
+        segment.vectors()
+        return segment
+
+    def get_many(self, rows: List[int]) -> dict:
+        return self.chunks.get_many(rows)
+
+    def rows_for_source(self, source: str) -> List[int]:
+        return self.chunks.rows_for_source(source)
+
+    def iter_docs(self):
+        return self.chunks.iter_docs()
+
+    def vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            self._vectors = np.load(self._base + ".npy", mmap_mode="r")
+        return self._vectors
+
+    def close(self):
+        """Unmaps the index and vectors and closes the chunk store. Only once no snapshot uses it."""
+        self.index = None
+        self._vectors = None
+        self.chunks.close()
+
+    def remove_files(self):
+        for ext in (".faiss", ".npy", ".chunks"):
+            path = self._base + ext
+            if os.path.exists(path):
+                os.remove(path)
+
+_refs_lock = threading.Lock()
+
+def _retain(segments):
+    with _refs_lock:
+        for seg in segments:
+            seg._refs += 1
+
+def _release(segments):
+    """Drops one snapshot's hold on segments. Closes those no snapshot uses now, deleting retired ones."""
+    unused = []
+    with _refs_lock:
+        for seg in segments:
+            seg._refs -= 1
+            if seg._refs == 0:
+                unused.append(seg)
+    for seg in unused:
+        seg.close()
+        if seg.retired:
+            seg.remove_files()
+
+class Snapshot:
+    """
+    Immutable view of the index at one manifest version: its segments and deleted rows.
+
+    All searches run against a snapshot. Writers never modify one; they publish
+    a new snapshot instead, so a reader sees exactly one version for as long as
+    it holds its snapshot and takes no locks while searching. A snapshot is
+    reference counted: one reference while it is the index's current snapshot,
+    plus one per reader. When the count drops to zero, segments no other
+    snapshot uses are closed.
+    """
+
+    def __init__(self, segments, deleted, version: int, content_version: int, embeddings, on_reclaim=None):
+        self.segments: Tuple[Segment, ...] = tuple(segments)
+        self.deleted = {name: frozenset(rows) for name, rows in deleted.items() if rows}
+        self.version = version
+        # Bumped by ingestion and deletes only, not compaction: what can be retrieved changed
+        self.content_version = content_version
+        self.embeddings = embeddings
+        self._refs = 1
+        self._lock = threading.Lock()
+        self._on_reclaim = on_reclaim
+        _retain(self.segments)
+
+    def acquire(self) -> bool:
+        """Adds a reader. Returns False if the snapshot was already reclaimed."""
+        with self._lock:
+            if self._refs == 0:
+                return False
+            self._refs += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            reclaim = self._refs == 0
+        if reclaim:
+            _release(self.segments)
+            if self._on_reclaim is not None:
+                self._on_reclaim()
+
+    def __enter__(self) -> "Snapshot":
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __len__(self):
+        return sum(len(seg) - len(self.deleted.get(seg.name, ())) for seg in self.segments)
+
+    def memory_bytes(self) -> int:
+        """Size of the mapped index files, i.e. what this snapshot can occupy in RAM."""
+        return sum(seg.nbytes for seg in self.segments)
+
+    def _vector_hits(self, embedding, k: int, nprobe: int = None, ef_search: int = None):
+        """Nearest live rows to embedding as (segment, row, distance), nearest first."""
+        query = np.asarray([embedding], dtype=np.float32)
+        results = []
+        for seg in self.segments:
+            seg_deleted = self.deleted.get(seg.name, ())
+            # Quantized segments over-fetch candidates, then re-score them exactly
+            wanted = k * INDEX_RERANK_FACTOR if seg.quantization != "none" else k
+            fetch = min(wanted + len(seg_deleted), len(seg))
+            params = search_params(seg.index, nprobe=nprobe, ef_search=ef_search, k=fetch)
+            distances, rows = seg.index.search(query, fetch, params=params)
+            distances, rows = distances[0], rows[0]
+            if seg.quantization != "none":
+                distances, rows = exact_rerank(seg.vectors(), query[0], rows)
+            for distance, row in zip(distances, rows):
+                if row < 0 or row in seg_deleted:
+                    continue
+                results.append((seg, int(row), float(distance)))
+        results.sort(key=lambda x: x[2])
+        return results[:k]
+
+    def _keyword_hits(self, query: str, k: int):
+        """Top live rows by BM25 as (segment, row, score), best first."""
+        segments = self.segments
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not segments:
+            return []
+
+        postings = [seg.chunks.postings(terms) for seg in segments]
+        doc_count, total_length = 0, 0
+        for seg in segments:
+            count, length = seg.chunks.lexical_stats()
+            doc_count += count
+            total_length += length
+        if not doc_count:
+            return []
+        avg_length = max(total_length / doc_count, 1.0)
+        idf = {
+            term: bm25_idf(doc_count, sum(len(p[term][0]) for p in postings if term in p))
+            for term in terms
+        }
+
+        results = []
+        for seg, seg_postings in zip(segments, postings):
+            if not seg_postings:
+                continue
+            scores = np.zeros(len(seg), dtype=np.float32)
+            for term, (rows, tf, lengths) in seg_postings.items():
+                np.add.at(scores, rows, bm25_scores(tf, lengths, idf[term], avg_length))
+            seg_deleted = self.deleted.get(seg.name)
+            if seg_deleted:
+                scores[list(seg_deleted)] = 0
+            top = min(k, int(np.count_nonzero(scores)))
+            if not top:
+                continue
+            rows = np.argpartition(-scores, top - 1)[:top]
+            results.extend((seg, int(row), float(scores[row])) for row in rows)
+        results.sort(key=lambda x: -x[2])
+        return results[:k]
+
+    @staticmethod
+    def _fetch(hits) -> List[Tuple[Document, float]]:
+        """Reads the chunk records for (segment, row, score) hits, keeping their order."""
+        # Only the final top-k chunk records are ever read from disk
+        fetched = {}
+        for seg in {seg for seg, _, _ in hits}:
+            rows = [row for s, row, _ in hits if s is seg]
+            for row, doc in seg.get_many(rows).items():
+                fetched[(seg.name, row)] = doc
+        return [(fetched[(seg.name, row)], score) for seg, row, score in hits]
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, nprobe: int = None, ef_search: int = None) -> List[Tuple[Document, float]]:
+        """nprobe / ef_search trade recall for speed on IVF / HNSW segments (flat segments ignore them)."""
+        return self._fetch(self._vector_hits(embedding, k, nprobe=nprobe, ef_search=ef_search))
+
+    def similarity_search_with_score(self, query: str, k: int = 4, nprobe: int = None, ef_search: int = None) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embeddings.embed_query(query), k=k, nprobe=nprobe, ef_search=ef_search)
+
+    def keyword_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        """BM25 keyword search. Scores are higher-is-better."""
+        return self._fetch(self._keyword_hits(query, k))
+
+    @staticmethod
+    def _vectors_for(hits) -> np.ndarray:
+        """Stored embeddings of (segment, row, score) hits, in hit order, as one matrix."""
+        dim = hits[0][0].vectors().shape[1]
+        out = np.empty((len(hits), dim), dtype=np.float32)
+        for seg in {seg for seg, _, _ in hits}:
+            positions = np.array([i for i, (s, _, _) in enumerate(hits) if s is seg])
+            rows = np.array([hits[i][1] for i in positions])
+            order = np.argsort(rows)  # sorted reads are kinder to the page cache
+            out[positions[order]] = seg.vectors()[rows[order]]
+        return out
+
+    def hybrid_search_with_score(self, query: str, k: int = 4, candidates: int = HYBRID_CANDIDATES,
+                                 nprobe: int = None, ef_search: int = None, embedding=None,
+                                 rerank=None, rerank_candidates: int = 0) -> List[Tuple[Document, float]]:
+        """
+        Runs vector and BM25 search and fuses them with reciprocal-rank fusion.
+        Returns the top k as (doc, fused score), best first (higher is better).
+        Pass embedding if the query was already embedded.
+
+        With rerank (see reranking.PostRetrieval), the top rerank_candidates fused
+        hits and their stored embeddings are passed to
+        rerank(query_embedding, vectors, scores, k), which returns the indices of
+        the hits to keep, in order.
+        """
+        pool = max(rerank_candidates, k) if rerank is not None else k
+        candidates = max(candidates, pool)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(query)
+        vector_hits = self._vector_hits(embedding, candidates, nprobe=nprobe, ef_search=ef_search)
+        keyword_hits = self._keyword_hits(query, candidates)
+
+        by_key = {(seg.name, row): seg for seg, row, _ in vector_hits + keyword_hits}
+        fused = reciprocal_rank_fusion([
+            [(seg.name, row) for seg, row, _ in vector_hits],
+            [(seg.name, row) for seg, row, _ in keyword_hits],
+        ])[:pool]
+        hits = [(by_key[key], key[1], score) for key, score in fused]
+        if rerank is not None and len(hits) > 1:
+            keep = rerank(embedding, self._vectors_for(hits), [score for _, _, score in hits], k)
+            hits = [hits[i] for i in keep]
+        return self._fetch(hits[:k])
+
+class SegmentedIndex:
+    """
+    Vector store over a folder of append-only segments.
+    Exposes the subset of the LangChain FAISS API the app uses (similarity_search_with_score, add_documents),
+    plus BM25 keyword and hybrid search. Each search runs on the snapshot that was current
+    when it started; use snapshot() to run several reads against the same version.
+    """
+
+    def __init__(self, folder: str, embeddings, writer: bool = True):
+        self.folder = folder
+        self.embeddings = embeddings
+        self.writer = writer
+        self.next_segment = 1
+        self.reloads = 0
+        self._manifest_path = os.path.join(folder, MANIFEST)
+        self._manifest_stamp = None  # stat of the manifest the current snapshot came from
+        self.live_snapshots = 0  # current + superseded ones still held by readers
+        self._snapshots_lock = threading.Lock()
+        self._snapshot = self._new_snapshot([], {}, 0, 0)
+        self._write_lock = threading.Lock()
+        self._compact_lock = threading.Lock()  # one compaction at a time
+        self._compact_wakeup = threading.Event()
+        self._compactor = None
+        self._closed = False
+
+    # The current snapshot's state, for callers that only need a quick look
+    @property
+    def segments(self) -> Tuple[Segment, ...]:
+        return self._snapshot.segments
+
+    @property
+    def deleted(self) -> dict:
+        return self._snapshot.deleted
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    @property
+    def content_version(self) -> int:
+        return self._snapshot.content_version
+
+    # ------------------------------------------------------------------
+    # Opening / recovery
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def open(cls, folder: str, embeddings, compact_in_background: bool = True, writer: bool = True) -> "SegmentedIndex":
+        """
+        Opens (or creates) the index, migrating a legacy LangChain FAISS folder if found.
+        With writer=False (another process writes this folder), the index follows the
+        manifest the writer publishes and never cleans up, migrates or compacts.
+        """
+        os.makedirs(folder, exist_ok=True)
+        store = cls(folder, embeddings, writer=writer)
+        with store._write_lock:
+            store._reload()
+        if writer:
+            if store._manifest_stamp is not None:
+                store._remove_orphans()
+            elif os.path.exists(os.path.join(folder, "index.faiss")):
+                store._migrate_legacy()
+            if compact_in_background:
+                store.start_compactor()
+        return store
+
+    def become_writer(self, compact_in_background: bool = True):
+        """Takes over writing after the process that used to write this folder went away."""
+        if self.writer:
+            return
+        with self._write_lock:
+            self._reload()
+            self.writer = True
+            self._remove_orphans()
+        if compact_in_background:
+            self.start_compactor()
+
+    def _stat_manifest(self):
+        try:
+            st = os.stat(self._manifest_path)
+        except FileNotFoundError:
+            return None
+        # os.replace() gives every new manifest a new inode
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def refresh(self) -> bool:
+        """Picks up a manifest another process has published. Returns whether it changed."""
+        if self._stat_manifest() == self._manifest_stamp:
+            return False
+        with self._write_lock:
+            return self._reload()
+
+    def _reload(self) -> bool:
+        """Publishes the on-disk manifest if it changed. Caller holds the write lock."""
+        for attempt in range(RELOAD_ATTEMPTS):
+            stamp = self._stat_manifest()
+            if stamp is None or stamp == self._manifest_stamp:
+                return False
+            with open(self._manifest_path) as f:
+                manifest = json.load(f)
+            current = self._snapshot
+            open_segments = {seg.name: seg for seg in current.segments}
+            try:
+                segments = [open_segments.get(name) or Segment.load(self.folder, name) for name in manifest["segments"]]
+            except Exception:
+                if self._stat_manifest() == stamp:
+                    raise
+                continue  # the writer compacted those segments away meanwhile: read the new manifest
+            self.next_segment = manifest["next_segment"]
+            self._manifest_stamp = stamp
+            self._publish(self._new_snapshot(
+                segments,
+                manifest["deleted"],
+                manifest["version"],
+                manifest.get("content_version", manifest["version"]),
+            ))
+            if current.version:
+                self.reloads += 1
+            return True
+        raise RuntimeError(f"Manifest of {self.folder} kept changing while it was being loaded")
+
+    def _remove_orphans(self):
+        """Deletes files left behind by a crash before their manifest was committed."""
+        live = {seg.name for seg in self.segments}
+        for filename in os.listdir(self.folder):
+            if filename == MANIFEST + ".tmp":
+                os.remove(os.path.join(self.folder, filename))
+            if not filename.startswith("seg-"):
+                continue
+            if filename.split(".")[0] not in live or filename.endswith(".tmp"):
+                os.remove(os.path.join(self.folder, filename))
+
+    def _migrate_legacy(self):
+        """One-time conversion of a LangChain FAISS.save_local folder into a segment."""
+        from langchain_community.vectorstores import FAISS
+        print(f"Migrating legacy FAISS index in {self.folder} to segments...")
+        legacy = FAISS.load_local(self.folder, self.embeddings, allow_dangerous_deserialization=True)
+        vectors = legacy.index.reconstruct_n(0, legacy.index.ntotal).astype(np.float32)
+        docs = []
+        for row in range(legacy.index.ntotal):
+            doc_id = legacy.index_to_docstore_id[row]
+            doc = legacy.docstore.search(doc_id)
+            docs.append(Document(id=doc_id, page_content=doc.page_content, metadata=doc.metadata))
+        self.add_documents(docs, vectors=vectors)
+        for filename in ("index.faiss", "index.pkl"):
+            os.replace(os.path.join(self.folder, filename), os.path.join(self.folder, filename + ".migrated"))
+        print(f"Migrated {len(docs)} chunks.")
+
+    # ------------------------------------------------------------------
+    # Snapshots
+    # ------------------------------------------------------------------
+
+    def snapshot(self) -> Snapshot:
+        """
+        Acquires the current snapshot for the caller, who must release it (use it as a
+        context manager). Never waits for writers or compaction, but first reloads the
+        manifest if another process has published a new version.
+        """
+        if not self._closed:
+            self.refresh()
+        while True:
+            snapshot = self._snapshot
+            if snapshot.acquire():
+                return snapshot
+            # Reclaimed between the read and acquire(): a newer one has been published
+            if snapshot is self._snapshot:
+                raise RuntimeError(f"Index {self.folder} is closed")
+
+    def _new_snapshot(self, segments, deleted, version: int, content_version: int) -> Snapshot:
+        with self._snapshots_lock:
+            self.live_snapshots += 1
+        return Snapshot(segments, deleted, version, content_version, self.embeddings, on_reclaim=self._snapshot_reclaimed)
+
+    def _snapshot_reclaimed(self):
+        with self._snapshots_lock:
+            self.live_snapshots -= 1
+
+    def _publish(self, snapshot: Snapshot):
+        """
+        Makes snapshot the current one (caller holds the write lock, or is open()).
+        Readers of the previous snapshot keep it until they release it.
+        """
+        previous, self._snapshot = self._snapshot, snapshot
+        previous.release()
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def _allocate_segment_name(self) -> str:
+        with self._write_lock:
+            name = f"seg-{self.next_segment:06d}"
+            self.next_segment += 1
+        return name
+
+    def _commit(self, new_segment: Segment = None, delete_sources=(), replace=None):
+        """
+        Applies one atomic change: optionally append an already written segment, tombstone
+        sources, or replace segments (compaction). The manifest rename is the commit point;
+        publishing the new snapshot then makes the change visible to readers.
+        Caller must hold no lock; this takes the write lock.
+        """
+        with self._write_lock:
+            # Normally a no-op: only a process that just took over writing can be behind
+            self._reload()
+            current = self._snapshot
+            segments = list(current.segments)
+            deleted = {name: set(rows) for name, rows in current.deleted.items()}
+            retired = []
+
+            for source in delete_sources:
+                for seg in segments:
+                    rows = seg.rows_for_source(source)
+                    if rows:
+                        deleted.setdefault(seg.name, set()).update(rows)
+
+            if replace is not None:
+                old_names, merged, row_map = replace
+                # Rows deleted while compaction was running carry over to the merged segment.
+                # row_map: {old segment: (its first row in merged, sorted old rows it kept)}
+                merged_deleted = set()
+                for name in old_names:
+                    rows = deleted.pop(name, set())
+                    if not rows or name not in row_map:
+                        continue
+                    offset, kept = row_map[name]
+                    rows = np.fromiter(rows, dtype=np.int64)
+                    at = np.searchsorted(kept, rows)
+                    found = at < len(kept)
+                    found[found] = kept[at[found]] == rows[found]
+                    merged_deleted.update(int(offset + i) for i in at[found])
+                first = min(i for i, seg in enumerate(segments) if seg.name in old_names)
+                retired = [seg for seg in segments if seg.name in old_names]
+                segments = [seg for seg in segments if seg.name not in old_names]
+                if merged is not None:
+                    segments.insert(first, merged)
+                    if merged_deleted:
+                        deleted[merged.name] = merged_deleted
+
+            if new_segment is not None:
+                segments.append(new_segment)
+
+            content_changed = new_segment is not None or bool(delete_sources)
+            manifest = {
+                "version": current.version + 1,
+                "content_version": current.content_version + content_changed,
+                "next_segment": self.next_segment,
+                "segments": [seg.name for seg in segments],
+                "deleted": {name: sorted(rows) for name, rows in deleted.items() if rows},
+            }
+            _write_json_atomic(self._manifest_path, manifest)
+            self._manifest_stamp = self._stat_manifest()
+
+            # Replaced segments' files go once no snapshot uses them any more
+            for seg in retired:
+                seg.retired = True
+            self._publish(self._new_snapshot(segments, deleted, manifest["version"], manifest["content_version"]))
+
+        if self._should_compact():
+            self._compact_wakeup.set()
+
+    def add_documents(self, docs: List[Document], vectors=None, delete_sources=()) -> List[str]:
+        """
+        Appends docs as a new segment, embedding them unless vectors are given.
+        delete_sources are removed in the same commit, so a replaced file never shows twice.
+        """
+        if not docs:
+            self._commit(delete_sources=delete_sources)
+            return []
+        if vectors is None:
+            vectors = self.embeddings.embed_documents([d.page_content for d in docs])
+        vectors = np.asarray(vectors, dtype=np.float32)
+        docs = [Document(id=d.id or uuid.uuid4().hex, page_content=d.page_content, metadata=d.metadata) for d in docs]
+        # Built off to the side without the write lock: nobody sees it until the commit publishes it
+        segment = Segment.write(self.folder, self._allocate_segment_name(), vectors, docs)
+        self._commit(new_segment=segment, delete_sources=delete_sources)
+        return [d.id for d in docs]
+
+    def delete_source(self, source: str):
+        self._commit(delete_sources=[source])
+
+    # ------------------------------------------------------------------
+    # Reads (each on the snapshot current when it starts)
+    # ------------------------------------------------------------------
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def memory_bytes(self) -> int:
+        """Size of the mapped index files, i.e. what this index can occupy in RAM."""
+        return self._snapshot.memory_bytes()
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, nprobe: int = None, ef_search: int = None) -> List[Tuple[Document, float]]:
+        with self.snapshot() as snapshot:
+            return snapshot.similarity_search_with_score_by_vector(embedding, k=k, nprobe=nprobe, ef_search=ef_search)
+
+    def similarity_search_with_score(self, query: str, k: int = 4, nprobe: int = None, ef_search: int = None) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embeddings.embed_query(query), k=k, nprobe=nprobe, ef_search=ef_search)
+
+    def keyword_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        with self.snapshot() as snapshot:
+            return snapshot.keyword_search_with_score(query, k=k)
+
+    def hybrid_search_with_score(self, query: str, k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        """See Snapshot.hybrid_search_with_score."""
+        with self.snapshot() as snapshot:
+            return snapshot.hybrid_search_with_score(query, k=k, **kwargs)
+
+    # ------------------------------------------------------------------
+    # Compaction
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _needs_rebuild(segments, deleted) -> bool:
+        """
+        True when the library has grown past the size its largest segment's index
+        type was built for, or that segment uses a different INDEX_QUANTIZATION.
+        """
+        if not segments:
+            return False
+        live = sum(len(seg) - len(deleted.get(seg.name, ())) for seg in segments)
+        target = choose_index_type(live)
+        largest = max(segments, key=len)
+        if target != "flat" and largest.kind != target:
+            return True
+        return largest.quantization != choose_quantization(len(largest))
+
+    @staticmethod
+    def _tier(live: int) -> int:
+        """Size tier of a segment with this many live rows: segments in one tier are within COMPACT_MERGE_FACTOR x."""
+        return int(math.log(max(live, 1), COMPACT_MERGE_FACTOR))
+
+    @classmethod
+    def _plan_compaction(cls, segments, deleted) -> Optional[List[Segment]]:
+        """
+        Picks the segments the next compaction rewrites into one, or None if none is due:
+        all of them when the index type must change, else fully deleted segments (dropped),
+        else the one with the most deleted rows past COMPACT_MAX_DELETED, else the smallest
+        tier holding COMPACT_MERGE_FACTOR segments, else the smallest segments when there
+        are more than COMPACT_MAX_SEGMENTS.
+        """
+        if cls._needs_rebuild(segments, deleted):
+            return list(segments)
+        live = {seg.name: len(seg) - len(deleted.get(seg.name, ())) for seg in segments}
+
+        empty = [seg for seg in segments if live[seg.name] == 0]
+        if empty:
+            return empty
+        dead = [seg for seg in segments if len(deleted.get(seg.name, ())) / len(seg) > COMPACT_MAX_DELETED]
+        if dead:
+            return [max(dead, key=lambda seg: len(deleted[seg.name]))]
+
+        tiers = {}
+        for seg in segments:
+            tiers.setdefault(cls._tier(live[seg.name]), []).append(seg)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= COMPACT_MERGE_FACTOR:
+                return tiers[tier]
+
+        if len(segments) > COMPACT_MAX_SEGMENTS:
+            by_size = sorted(segments, key=lambda seg: live[seg.name])
+            return by_size[:len(segments) - COMPACT_MAX_SEGMENTS + 1]
+        return None
+
+    def _should_compact(self) -> bool:
+        snapshot = self._snapshot
+        return self._plan_compaction(snapshot.segments, snapshot.deleted) is not None
+
+    def compact(self):
+        """
+        Runs one compaction step (see _plan_compaction), dropping deleted rows from
+        the segments it rewrites. A merged segment gets the index type its size calls
+        for, and a full merge is how the library moves from flat to HNSW to IVF as it
+        grows. The background compactor repeats this until nothing is due.
+        """
+        with self._compact_lock:
+            self._compact()
+
+    def _compact(self):
+        with self.snapshot() as snapshot:
+            deleted = snapshot.deleted
+            group = self._plan_compaction(snapshot.segments, deleted)
+            if not group:
+                return
+
+            # Only the vectors are gathered in memory (FAISS builds from all of them at once);
+            # chunk records stream from the old stores into the new one
+            row_map, kept_vectors, total = {}, [], 0
+            for seg in group:
+                seg_deleted = deleted.get(seg.name, set())
+                kept = np.setdiff1d(np.arange(len(seg), dtype=np.int64), np.fromiter(seg_deleted, dtype=np.int64))
+                if len(kept):
+                    row_map[seg.name] = (total, kept)
+                    kept_vectors.append((seg, kept))
+                    total += len(kept)
+
+            def docs():
+                for seg, kept in kept_vectors:
+                    seg_deleted = deleted.get(seg.name, set())
+                    for row, doc in enumerate(seg.iter_docs()):
+                        if row not in seg_deleted:
+                            yield doc
+
+            if total:
+                dim = kept_vectors[0][0].vectors().shape[1]
+                vectors = np.empty((total, dim), dtype=np.float32)
+                for seg, kept in kept_vectors:
+                    offset = row_map[seg.name][0]
+                    vectors[offset:offset + len(kept)] = seg.vectors()[kept]
+                merged = Segment.write(self.folder, self._allocate_segment_name(), vectors, docs())
+                del vectors
+            else:
+                merged = None  # everything was deleted: drop the segments outright
+
+        self._commit(replace=({seg.name for seg in group}, merged, row_map))
+        if merged is not None:
+            print(f"Compacted {len(group)} segments into {merged.name} ({total} chunks)")
+        else:
+            print(f"Dropped {len(group)} fully deleted segments")
+
+    def start_compactor(self, interval: float = COMPACT_INTERVAL):
+        """Starts the background compaction thread (checks every interval, or when woken after a commit)."""
+        if self._compactor is not None:
+            return
+
+        def run():
+            while not self._closed:
+                self._compact_wakeup.wait(timeout=interval)
+                self._compact_wakeup.clear()
+                if self._closed:
+                    break
+                try:
+                    if self._should_compact():
+                        self.compact()
+                except Exception as e:
+                    print(f"Index compaction failed: {e}")
+
+        self._compactor = threading.Thread(target=run, name="index-compactor", daemon=True)
+        self._compactor.start()
+
+    def close(self):
+        """
+        Stops background compaction, waiting for a running one to finish, and drops the
+        index's own reference to its current snapshot. Readers still holding a snapshot
+        keep working; its segments are closed when the last of them releases it.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._compact_wakeup.set()
+        if self._compactor is not None and self._compactor is not threading.current_thread():
+            self._compactor.join()
+        with self._write_lock:
+            self._snapshot.release()
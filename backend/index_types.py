@@ -0,0 +1,156 @@
+"""
+Picks and builds the FAISS index type for a segment based on its size.
+
+    < INDEX_HNSW_MIN_VECTORS        flat (exact, brute force)
+    < INDEX_IVF_MIN_VECTORS         HNSW graph
+    otherwise                       IVF (inverted lists, trained on a sample)
+
+Small segments stay exact: scanning a few thousand vectors is already fast and
+an approximate index would only cost recall. HNSW gives the best latency per
+unit of recall in the middle range; past a million or so vectors its graph
+takes too long to build and too much memory, so large segments use IVF.
+Segments are immutable, so a type is chosen when a segment is written (uploads
+and background compaction) and never changes afterwards.
+"""
+import os
+import time
+from typing import Optional
+
+import faiss
+import numpy as np
+
+INDEX_HNSW_MIN_VECTORS = int(os.getenv("INDEX_HNSW_MIN_VECTORS", "50000"))
+INDEX_IVF_MIN_VECTORS = int(os.getenv("INDEX_IVF_MIN_VECTORS", "1000000"))
+# Neighbours per HNSW node: more means better recall, more memory
+INDEX_HNSW_M = int(os.getenv("INDEX_HNSW_M", "32"))
+# Default search-time knobs, overridable per request
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "16"))
+
+# Compressed vector codes: "none" (float32), "sq8" (8-bit scalar, 4x smaller)
+# or "pq" (product quantization, ~32x smaller). Quantized segments re-rank
+# INDEX_RERANK_FACTOR * k candidates with the exact vectors before returning k.
+INDEX_QUANTIZATION = os.getenv("INDEX_QUANTIZATION", "none").lower()
+INDEX_RERANK_FACTOR = int(os.getenv("INDEX_RERANK_FACTOR", "4"))
+
+HNSW_EF_CONSTRUCTION = 80
+# k-means needs ~40 points per list to train well; more is wasted time
+IVF_TRAIN_POINTS_PER_LIST = 64
+PQ_MIN_VECTORS = 10000
+QUANTIZER_TRAIN_POINTS = 65536
+
+def choose_index_type(n_vectors: int) -> str:
+    if n_vectors < INDEX_HNSW_MIN_VECTORS:
+        return "flat"
+    if n_vectors < INDEX_IVF_MIN_VECTORS:
+        return "hnsw"
+    return "ivf"
+
+def index_type(index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+def choose_quantization(n_vectors: int) -> str:
+    # PQ codebooks need a few thousand vectors to train; smaller segments fall back to SQ8
+    if INDEX_QUANTIZATION == "pq" and n_vectors < PQ_MIN_VECTORS:
+        return "sq8"
+    return INDEX_QUANTIZATION
+
+def index_quantization(index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "sq8"
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    return "none"
+
+def _pq_subquantizers(dim: int) -> int:
+    """Largest m <= dim / 8 that divides dim, i.e. about 1 byte per 8 dimensions."""
+    m = max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+def _sample(vectors: np.ndarray, size: int) -> np.ndarray:
+    n = len(vectors)
+    if size >= n:
+        return vectors
+    return vectors[np.sort(np.random.default_rng(0).choice(n, size, replace=False))]
+
+def build_index(vectors: np.ndarray, kind: Optional[str] = None, quantization: Optional[str] = None):
+    """
+    Builds an L2 index over vectors. kind and quantization are chosen from the
+    vector count and INDEX_QUANTIZATION when not given.
+    """
+    n, dim = vectors.shape
+    kind = kind or choose_index_type(n)
+    quantization = quantization or choose_quantization(n)
+    sq8 = faiss.ScalarQuantizer.QT_8bit
+    pq_m = _pq_subquantizers(dim)
+    t0 = time.time()
+
+    if kind == "hnsw":
+        if quantization == "sq8":
+            index = faiss.IndexHNSWSQ(dim, sq8, INDEX_HNSW_M)
+        elif quantization == "pq":
+            index = faiss.IndexHNSWPQ(dim, pq_m, INDEX_HNSW_M)
+        else:
+            index = faiss.IndexHNSWFlat(dim, INDEX_HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        train_size = QUANTIZER_TRAIN_POINTS
+    elif kind == "ivf":
+        nlist = max(1, int(4 * np.sqrt(n)))
+        quantizer = faiss.IndexFlatL2(dim)
+        if quantization == "sq8":
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, sq8)
+        elif quantization == "pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, 8)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        train_size = max(nlist * IVF_TRAIN_POINTS_PER_LIST, QUANTIZER_TRAIN_POINTS if quantization != "none" else 0)
+    else:
+        if quantization == "sq8":
+            index = faiss.IndexScalarQuantizer(dim, sq8, faiss.METRIC_L2)
+        elif quantization == "pq":
+            index = faiss.IndexPQ(dim, pq_m, 8)
+        else:
+            index = faiss.IndexFlatL2(dim)
+        train_size = QUANTIZER_TRAIN_POINTS
+
+    if not index.is_trained:
+        index.train(_sample(vectors, train_size))
+    index.add(vectors)
+
+    if kind != "flat" or quantization != "none":
+        label = kind if quantization == "none" else f"{kind}/{quantization}"
+        code_size = {"sq8": dim, "pq": pq_m}.get(quantization, dim * 4)
+        print(f"Built {label} index over {n} vectors in {time.time() - t0:.1f}s "
+              f"({code_size} bytes/vector for codes, {dim * 4} uncompressed)")
+    return index
+
+def search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None, k: int = 1):
+    """SearchParameters for index's type, or None for flat indexes."""
+    kind = index_type(index)
+    if kind == "hnsw":
+        # efSearch below k can't return k results
+        return faiss.SearchParametersHNSW(efSearch=max(ef_search or INDEX_EF_SEARCH, k))
+    if kind == "ivf":
+        return faiss.SearchParametersIVF(nprobe=min(nprobe or INDEX_NPROBE, index.nlist))
+    return None
+
+def exact_rerank(vectors: np.ndarray, query: np.ndarray, rows: np.ndarray):
+    """
+    Re-scores candidate rows with exact squared L2 distances, nearest first.
+    vectors is the segment's memory-mapped raw vectors; only the candidate rows are read.
+    """
+    rows = rows[rows >= 0]
+    order = np.argsort(rows)  # sorted reads are kinder to the page cache
+    exact = np.asarray(vectors[rows[order]], dtype=np.float32)
+    distances = np.empty(len(rows), dtype=np.float32)
+    distances[order] = ((exact - query) ** 2).sum(axis=1)
+    best = np.argsort(distances)
+    return distances[best], rows[best]
@@ -0,0 +1,218 @@
+"""
+Parallel PDF parsing and chunking for the ingestion path.
+
+PDF text extraction and splitting are CPU-bound and hold the GIL, so they run
+in a process pool. Large PDFs are cut into page ranges so one big book is
+spread over several workers. Results are collected in task order, so chunk
+order and metadata are the same as a sequential load + split.
+
+Ingestion consumes the results as a stream (stream_parsed) instead of a list:
+at most INGEST_WORKERS page ranges are being parsed and INGEST_PARSE_PREFETCH
+parsed ones wait for the embedding stage, so memory stays flat however long
+the book is, and embedding starts as soon as the first range is parsed.
+"""
+import os
+import asyncio
+import threading
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Iterator, List, Tuple
+
+from pypdf import PdfReader
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Number of parser processes. Defaults to one per core.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+# PDFs with more pages than this are split into page ranges of this size.
+PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "100"))
+# Parsed page ranges queued ahead of the embedding stage.
+INGEST_PARSE_PREFETCH = int(os.getenv("INGEST_PARSE_PREFETCH", "2"))
+
+CHUNK_SIZE = 900
+CHUNK_OVERLAP = 150
+
+def make_splitter():
+    # start_index lets the context builder merge overlapping chunks of a page exactly
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+
+def plan_tasks(file_paths: List[str], pages_per_task: int = PAGES_PER_TASK) -> List[Tuple[str, int, int]]:
+    """
+    Turns a list of PDFs into (pdf_file, start_page, end_page) tasks.
+    Unreadable files get a single task so the worker reports the error.
+    """
+    tasks = []
+    for pdf_file in file_paths:
+        try:
+            with open(pdf_file, "rb") as f:
+                total_pages = len(PdfReader(f).pages)
+        except Exception:
+            tasks.append((pdf_file, 0, -1))
+            continue
+        for start in range(0, max(total_pages, 1), pages_per_task):
+            tasks.append((pdf_file, start, min(start + pages_per_task, total_pages)))
+    return tasks
+
+def load_pages(pdf_file: str, start: int, end: int) -> List[Document]:
+    """Extracts pages [start, end) of a PDF as one Document per page."""
+    # From an open file, pypdf reads objects on demand instead of loading the whole PDF
+    with open(pdf_file, "rb") as f:
+        reader = PdfReader(f)
+        total_pages = len(reader.pages)
+        if end < 0:
+            end = total_pages
+        source = os.path.basename(pdf_file)
+        docs = []
+        for page_number in range(start, end):
+            text = reader.pages[page_number].extract_text().strip()
+            docs.append(Document(
+                page_content=text,
+                metadata={
+                    "source": source,
+                    "total_pages": total_pages,
+                    "page": page_number,
+                    "page_label": reader.page_labels[page_number],
+                },
+            ))
+        return docs
+
+def _load_and_split(task: Tuple[str, int, int]):
+    """Worker entry point. Returns (pages_loaded, chunks, error)."""
+    pdf_file, start, end = task
+    try:
+        docs = load_pages(pdf_file, start, end)
+        chunks = make_splitter().split_documents(docs)
+        return len(docs), chunks, None
+    except Exception as e:
+        return 0, [], f"{type(e).__name__}: {e}"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def parser_pool() -> ProcessPoolExecutor:
+    """The process pool every job parses on, so concurrent jobs share INGEST_WORKERS processes."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the API process runs threads (uvicorn, background tasks)
+            ctx = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=ctx)
+        return _pool
+
+def shutdown_parser_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Drops a broken pool, so the next job starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+def iter_parsed(tasks: List[Tuple[str, int, int]], workers: int = INGEST_WORKERS) -> Iterator[tuple]:
+    """
+    Parses tasks, yielding (task, pages_loaded, chunks, error) in task order.
+    With a pool, at most `workers` tasks run ahead of the consumer.
+    """
+    workers = max(1, min(workers, INGEST_WORKERS, len(tasks)))
+    if workers == 1:
+        for task in tasks:
+            yield (task, *_load_and_split(task))
+        return
+
+    pool = parser_pool()
+    remaining = iter(tasks)
+    running = deque()
+    try:
+        running.extend((task, pool.submit(_load_and_split, task)) for task in islice(remaining, workers))
+        while running:
+            task, future = running.popleft()
+            result = future.result()
+            # Refill before handing the result out, so the pool keeps working meanwhile
+            next_task = next(remaining, None)
+            if next_task is not None:
+                running.append((next_task, pool.submit(_load_and_split, next_task)))
+            yield (task, *result)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    finally:
+        # Ranges not started yet are dropped; the pool itself stays up for other jobs
+        for _, future in running:
+            future.cancel()
+
+async def stream_parsed(tasks: List[Tuple[str, int, int]], workers: int = INGEST_WORKERS,
+                        prefetch: int = INGEST_PARSE_PREFETCH) -> AsyncIterator[tuple]:
+    """
+    iter_parsed, run on a background thread so parsing overlaps whatever the
+    consumer awaits. At most `prefetch` results wait to be consumed. Stopping
+    early stops the parser after the ranges it is working on.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    slots = threading.Semaphore(max(1, prefetch))
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:  # event loop already closed
+            stop.set()
+
+    def produce():
+        parsed = iter_parsed(tasks, workers)
+        try:
+            for item in parsed:
+                while not slots.acquire(timeout=0.5):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                put(item)
+        except Exception as e:
+            put(e)
+        finally:
+            parsed.close()
+            put(done)
+
+    threading.Thread(target=produce, name="ingest-parse", daemon=True).start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            slots.release()
+            yield item
+    finally:
+        stop.set()
+
+def load_and_split(file_paths: List[str], workers: int = INGEST_WORKERS) -> List[Document]:
+    """
+    Parses and splits PDFs, in parallel when there is more than one task.
+    Chunks are returned in file order, then page order.
+    """
+    tasks = plan_tasks(file_paths)
+    workers = max(1, min(workers, len(tasks)))
+    print(f"Parsing {len(file_paths)} files as {len(tasks)} tasks on {workers} worker(s)...")
+    chunks = []
+    for (pdf_file, start, end), pages, task_chunks, error in iter_parsed(tasks, workers):
+        log_parsed(pdf_file, start, end, pages, task_chunks, error)
+        if not error:
+            chunks.extend(task_chunks)
+    return chunks
+
+def log_parsed(pdf_file: str, start: int, end: int, pages: int, chunks: List[Document], error):
+    if error:
+        print(f"Error loading {pdf_file} (pages {start}-{end}): {error}")
+    else:
+        print(f"Loaded {pages} pages from {pdf_file} (pages {start}-{end}) -> {len(chunks)} chunks")
@@ -0,0 +1,294 @@
+"""
+Persistent ingestion jobs with resumable embedding checkpoints.
+
+Every upload becomes an IngestionJob row (plus one IngestionJobFile row per
+file) before any work starts. A job's progress is therefore visible at
+/jobs/{id} and survives restarts. Embedding is the expensive part, so after
+each batch the new vectors are appended to the job's checkpoint file and
+fsynced, and only then is embedded_chunks advanced in the database. The file
+may hold more rows than the database says (a crash between the two steps),
+never fewer. The extra rows are discarded on resume.
+
+Chunking is deterministic, so a resumed job re-parses its files and reuses
+the checkpointed vectors chunk by chunk: next to each vector the checkpoint
+stores a digest of its chunk, and from the first chunk that no longer matches
+(a file changed) the rest is embedded again. On startup, jobs still marked
+queued or running are resumed.
+
+Chunks reach the index while the job runs, in several commits (see
+run_ingestion_job in main.py), so a book becomes searchable as it is
+processed. The first commit of each file in an attempt also deletes that
+file's old chunks, including any an interrupted attempt already indexed, so
+resuming never indexes a file twice.
+
+When the app runs with several worker processes, every worker accepts
+uploads (which only record a job), but jobs run in exactly one of them: the
+worker holding the IngestionLock, an exclusive lock on INGEST_LOCK_FILE. It
+also does all index writes and compaction. If that worker exits, the OS
+releases the lock and another worker takes over on its next poll.
+"""
+import os
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+import models
+from database import SessionLocal
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so only single-worker deployments are supported
+    fcntl = None
+
+INGEST_CHECKPOINT_FOLDER = os.getenv("INGEST_CHECKPOINT_FOLDER", os.path.join("data", "jobs"))
+# First embedding batch size; EmbeddingPipeline adapts it from there
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "100"))
+# Chunks are committed to the index (and become searchable) in pieces of this many,
+# or whatever has been embedded after this many seconds
+INGEST_COMMIT_CHUNKS = int(os.getenv("INGEST_COMMIT_CHUNKS", "1000"))
+INGEST_COMMIT_SECONDS = float(os.getenv("INGEST_COMMIT_SECONDS", "30"))
+INGEST_LOCK_FILE = os.getenv("INGEST_LOCK_FILE", os.path.join("data", "ingest.lock"))
+# Seconds between checks for new jobs (and, in other workers, for the lock)
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "2"))
+
+CHUNK_DIGEST_SIZE = 16
+
+def chunk_digest(chunk: Document) -> bytes:
+    """Identifies a chunk by its source, position and text, to match it against a checkpoint row."""
+    hasher = hashlib.sha256()
+    hasher.update(f"{chunk.metadata.get('source')}\0{chunk.metadata.get('page')}\0{chunk.metadata.get('start_index')}\0".encode("utf-8"))
+    hasher.update(chunk.page_content.encode("utf-8"))
+    return hasher.digest()[:CHUNK_DIGEST_SIZE]
+
+class Checkpoint:
+    """
+    Append-only files with the vectors a job has embedded so far, in chunk order
+    (job-N.f32, float32), and the digest of each of those chunks (job-N.sha).
+    """
+
+    def __init__(self, job_id: int, folder: str = INGEST_CHECKPOINT_FOLDER):
+        self.path = os.path.join(folder, f"job-{job_id}.f32")
+        self.digest_path = os.path.join(folder, f"job-{job_id}.sha")
+        self.rows = 0
+        self.dim = None
+        os.makedirs(folder, exist_ok=True)
+
+    def open(self, rows: int, dim: Optional[int]) -> int:
+        """
+        Keeps the first rows rows (rows written after the last recorded progress are
+        cut off) and returns how many there are to resume from.
+        """
+        if not rows or not dim or not os.path.exists(self.path) or not os.path.exists(self.digest_path):
+            self.reset()
+            return 0
+        if os.path.getsize(self.path) < rows * dim * 4 or os.path.getsize(self.digest_path) < rows * CHUNK_DIGEST_SIZE:
+            raise ValueError(f"Checkpoint {self.path} is shorter than its recorded progress")
+        self.dim = dim
+        self.truncate(rows)
+        return rows
+
+    def read(self, start: int, count: int) -> Tuple[np.ndarray, List[bytes]]:
+        """Vectors and chunk digests of rows [start, start + count)."""
+        count = max(0, min(count, self.rows - start))
+        vectors = np.fromfile(self.path, dtype=np.float32, count=count * self.dim, offset=start * self.dim * 4)
+        with open(self.digest_path, "rb") as f:
+            f.seek(start * CHUNK_DIGEST_SIZE)
+            data = f.read(count * CHUNK_DIGEST_SIZE)
+        digests = [data[i:i + CHUNK_DIGEST_SIZE] for i in range(0, len(data), CHUNK_DIGEST_SIZE)]
+        return vectors.reshape(count, self.dim), digests
+
+    def append(self, vectors, digests: List[bytes]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        for path, data in ((self.path, vectors.tobytes()), (self.digest_path, b"".join(digests))):
+            with open(path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        self.dim = vectors.shape[1]
+        self.rows += len(vectors)
+
+    def truncate(self, rows: int):
+        for path, row_size in ((self.path, self.dim * 4), (self.digest_path, CHUNK_DIGEST_SIZE)):
+            with open(path, "r+b") as f:
+                f.truncate(rows * row_size)
+        self.rows = rows
+
+    def reset(self):
+        for path in (self.path, self.digest_path):
+            with open(path, "wb"):
+                pass
+        self.rows = 0
+
+    def remove(self):
+        for path in (self.path, self.digest_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+class IngestionLock:
+    """Exclusive, non-blocking process lock. Once taken it is held until the process exits."""
+
+    def __init__(self, path: str = INGEST_LOCK_FILE):
+        self.path = path
+        self.held = False
+        self._fd = None
+
+    def try_acquire(self) -> bool:
+        if self.held:
+            return True
+        if fcntl is None:
+            self.held = True
+            return True
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        # For humans: which process is the ingestion worker
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        self.held = True
+        return True
+
+# ----------------------------------------------------------------------
+# Job rows. Each helper uses its own short session, like record_documents.
+# ----------------------------------------------------------------------
+
+def create_job(user_id: Optional[int], files: List[dict]) -> int:
+    """files: [{"file_path", "content_hash", "replaces_existing"}]. Returns the job id."""
+    db = SessionLocal()
+    try:
+        job = models.IngestionJob(user_id=user_id, status="queued")
+        for f in files:
+            job.files.append(models.IngestionJobFile(
+                filename=os.path.basename(f["file_path"]),
+                file_path=f["file_path"],
+                content_hash=f["content_hash"],
+                replaces_existing=f["replaces_existing"],
+            ))
+        db.add(job)
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+def start_job(job_id: int) -> Optional[dict]:
+    """Marks the job running and returns what the worker needs, or None if there is nothing to do."""
+    db = SessionLocal()
+    try:
+        job = db.get(models.IngestionJob, job_id)
+        if job is None or job.status in ("succeeded", "failed"):
+            return None
+        job.status = "running"
+        job.attempts += 1
+        job.error = None
+        # Parsing and indexing start over on every attempt; embedding resumes from the checkpoint
+        job.total_chunks = job.parsed_pages = job.indexed_chunks = 0
+        for f in job.files:
+            f.status, f.chunks, f.error = "pending", 0, None
+        db.commit()
+        return {
+            "user_id": job.user_id,
+            "embedded_chunks": job.embedded_chunks,
+            "embedding_dim": job.embedding_dim,
+            "files": [
+                {"file_path": f.file_path, "content_hash": f.content_hash, "replaces_existing": f.replaces_existing}
+                for f in job.files
+            ],
+        }
+    finally:
+        db.close()
+
+def record_plan(job_id: int, total_pages: int):
+    db = SessionLocal()
+    try:
+        job = db.get(models.IngestionJob, job_id)
+        job.total_pages = total_pages
+        db.commit()
+    finally:
+        db.close()
+
+def record_parsed(job_id: int, counts: Dict[str, int], parsed_pages: int, finished_files: List[str],
+                  errors: Dict[str, str], fingerprint: Optional[str] = None):
+    """
+    Stores parsing progress: chunks per file so far, and the final status of
+    finished_files (failed if a page range couldn't be parsed, given in errors,
+    or if they produced no chunks). fingerprint is given once the whole job
+    has been parsed.
+    """
+    db = SessionLocal()
+    try:
+        job = db.get(models.IngestionJob, job_id)
+        job.total_chunks = sum(counts.values())
+        job.parsed_pages = parsed_pages
+        if fingerprint:
+            job.chunks_fingerprint = fingerprint
+        for f in job.files:
+            f.chunks = counts.get(f.filename, 0)
+            if f.filename not in finished_files or f.status != "pending":
+                continue
+            if f.filename in errors:
+                f.status = "failed"
+                f.error = errors[f.filename]
+            elif f.chunks:
+                f.status = "parsed"
+            else:
+                f.status = "failed"
+                f.error = "No text could be extracted."
+        db.commit()
+    finally:
+        db.close()
+
+def record_progress(job_id: int, embedded_chunks: int, embedding_dim: int):
+    db = SessionLocal()
+    try:
+        job = db.get(models.IngestionJob, job_id)
+        job.embedded_chunks = embedded_chunks
+        job.embedding_dim = embedding_dim
+        db.commit()
+    finally:
+        db.close()
+
+def record_indexed(job_id: int, indexed_chunks: int):
+    db = SessionLocal()
+    try:
+        job = db.get(models.IngestionJob, job_id)
+        job.indexed_chunks = indexed_chunks
+        db.commit()
+    finally:
+        db.close()
+
+def finish_job(job_id: int, error: Optional[str] = None):
+    db = SessionLocal()
+    try:
+        job = db.get(models.IngestionJob, job_id)
+        job.status = "failed" if error else "succeeded"
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        if not error:
+            for f in job.files:
+                if f.status == "parsed":
+                    f.status = "indexed"
+            # The job succeeds if any file was indexed; the others are named here
+            failed = [f.filename for f in job.files if f.status == "failed"]
+            if failed:
+                job.error = f"{len(failed)} of {len(job.files)} files failed: {', '.join(failed)}"
+        db.commit()
+    finally:
+        db.close()
+
+def unfinished_jobs() -> List[Tuple[int, Optional[int]]]:
+    """(job_id, user_id) of queued and running jobs, oldest first."""
+    db = SessionLocal()
+    try:
+        rows = db.query(models.IngestionJob.id, models.IngestionJob.user_id).filter(
+            models.IngestionJob.status.in_(("queued", "running"))
+        ).order_by(models.IngestionJob.id)
+        return [(row.id, row.user_id) for row in rows]
+    finally:
+        db.close()
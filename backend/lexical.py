@@ -0,0 +1,69 @@
+"""
+BM25 keyword scoring and reciprocal-rank fusion for hybrid retrieval.
+
+Vector search is good at paraphrase but weak on exact terms: names, verse
+references ("3:45") and transliterations ("Isa", "ʿĪsā"). Each segment's
+ChunkStore keeps an inverted index (term -> rows, term frequency) written
+together with the segment, so the keyword index grows incrementally with
+ingestion and is rebuilt by compaction like everything else. Collection
+statistics (document count, average length, document frequency) are summed
+over the live segments at query time, so scores are comparable across
+segments.
+"""
+import os
+import re
+import unicodedata
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Standard RRF constant: damps the influence of the very top ranks of either list
+RRF_K = 60
+# Candidates taken from each retriever before fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+
+_TOKEN = re.compile(r"\d+:\d+|\w+")
+_POSSESSIVE = re.compile(r"['’]s\b")
+# Apostrophes and the ayn/hamza marks used in transliteration
+_MARKS = re.compile(r"['’‘`ʿʾ]")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from had has have he her his i in is it its
+of on or she that the their them they this to was were which who will with
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens with diacritics and transliteration marks removed,
+    so "ʿĪsā", "Isa" and "'Isa" are the same term. Verse references like
+    "3:45" are kept as one token.
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = _MARKS.sub("", _POSSESSIVE.sub("", text.lower()))
+    return [t for t in _TOKEN.findall(text) if t not in STOPWORDS]
+
+def term_frequencies(text: str) -> Tuple[Dict[str, int], int]:
+    """Returns ({term: count}, document length in tokens)."""
+    tokens = tokenize(text)
+    counts = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    return counts, len(tokens)
+
+def bm25_idf(doc_count: int, df: int) -> float:
+    return float(np.log(1 + (doc_count - df + 0.5) / (df + 0.5)))
+
+def bm25_scores(tf: np.ndarray, lengths: np.ndarray, idf: float, avg_length: float) -> np.ndarray:
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+    return idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+def reciprocal_rank_fusion(rankings: Iterable[List[Hashable]], k: int = RRF_K) -> List[Tuple[Hashable, float]]:
+    """Fuses ranked lists of keys. Returns (key, score) pairs, best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda x: -x[1])
@@ -0,0 +1,88 @@
+"""
+Checks that chat requests don't block the event loop: measures /health
+latency on an idle server, then again while CHATS chat requests are in
+flight, and fails if the loaded p99 is more than MAX_SLOWDOWN x the idle
+p99. A blocked loop shows up as stalls as long as a whole retrieval or LLM
+call; FLOOR_MS allows for the ordinary CPU contention of running the server,
+the model and this script on one small machine.
+
+Needs a running server with at least one document indexed. All chats come
+from one identity, so the scheduler sheds the ones over
+GENERATION_MAX_QUEUED_PER_USER with 429; those count as answered quickly,
+which is what they are for the event loop.
+
+    python load_test.py [base_url] [token]
+"""
+import sys
+import time
+import asyncio
+
+import httpx
+
+BASE_URL = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8000"
+TOKEN = sys.argv[2] if len(sys.argv) > 2 else None
+CHATS = 20
+ROUNDS = 3
+PING_INTERVAL = 0.05
+BASELINE_PINGS = 100
+MAX_SLOWDOWN = 3
+FLOOR_MS = 250
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], latencies[-1]
+
+async def ping(client):
+    t0 = time.perf_counter()
+    response = await client.get("/health")
+    response.raise_for_status()
+    return (time.perf_counter() - t0) * 1000
+
+async def chat(client, i):
+    t0 = time.perf_counter()
+    response = await client.post("/chat", json={
+        "question": f"What does the document say about topic {i}?",
+        "bypass_cache": True,
+    })
+    if response.status_code == 429:
+        return None  # shed by the generation scheduler
+    response.raise_for_status()
+    return time.perf_counter() - t0
+
+async def main():
+    headers = {"Authorization": f"Bearer {TOKEN}"} if TOKEN else {}
+    limits = httpx.Limits(max_connections=CHATS + 5)
+    async with httpx.AsyncClient(base_url=BASE_URL, headers=headers, timeout=600, limits=limits) as client:
+        await ping(client)  # warm up the connection
+        idle = []
+        for _ in range(BASELINE_PINGS):
+            idle.append(await ping(client))
+            await asyncio.sleep(PING_INTERVAL / 5)
+
+        loaded, chat_times = [], []
+        for _ in range(ROUNDS):
+            chats = [asyncio.create_task(chat(client, i)) for i in range(CHATS)]
+            while not all(task.done() for task in chats):
+                loaded.append(await ping(client))
+                await asyncio.sleep(PING_INTERVAL)
+            chat_times += [task.result() for task in chats]
+
+    idle_p50, idle_p99, idle_max = percentiles(idle)
+    p50, p99, worst = percentiles(loaded)
+    print(f"/health idle         p50 {idle_p50:6.2f} ms   p99 {idle_p99:6.2f} ms   max {idle_max:6.2f} ms   ({len(idle)} pings)")
+    print(f"/health {CHATS} chats     p50 {p50:6.2f} ms   p99 {p99:6.2f} ms   max {worst:6.2f} ms   ({len(loaded)} pings)")
+    answered = [t for t in chat_times if t is not None]
+    shed = len(chat_times) - len(answered)
+    if answered:
+        print(f"{len(answered)} of {CHATS} x {ROUNDS} chats answered in {min(answered):.2f}-{max(answered):.2f}s, {shed} shed with 429")
+    else:
+        print(f"All {shed} chats were shed with 429")
+
+    limit = max(idle_p99 * MAX_SLOWDOWN, FLOOR_MS)
+    if p99 > limit:
+        print(f"FAIL: loaded p99 {p99:.2f} ms > {limit:.2f} ms")
+        sys.exit(1)
+    print(f"PASS: loaded p99 {p99:.2f} ms <= {limit:.2f} ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
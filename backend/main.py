@@ -1,32 +1,64 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from sqlalchemy.orm import Session
-import shutil
 import os
+import json
 import sys
 import tempfile
 import glob
+import hashlib
+import time
+import asyncio
+import threading
+from collections import Counter, deque
+from contextlib import aclosing
+from datetime import datetime
 
-# Reuse logic from our library script
-from langchain_ollama import ChatOllama, OllamaEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
+import numpy as np
+
+import httpx
+
+from ollama_client import OllamaClient, PooledEmbeddings
 
 # Docker support: Use environment variable for Ollama URL
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# Comma-separated Ollama servers for each kind of work (see ollama_client.py)
+OLLAMA_EMBED_URLS = os.getenv("OLLAMA_EMBED_URLS", OLLAMA_BASE_URL)
+OLLAMA_GENERATE_URLS = os.getenv("OLLAMA_GENERATE_URLS", OLLAMA_BASE_URL)
+CHAT_MODEL = "mistral"
+EMBED_MODEL = "nomic-embed-text"
 
 from fastapi.middleware.cors import CORSMiddleware
 
 # Import our auth and database modules
 import models
 import schemas
-from database import engine, get_db
-from auth import get_password_hash, authenticate_user, create_access_token, get_current_user
+from database import engine, get_db, SessionLocal, add_missing_columns, relax_not_null_columns, schema_lock, process_lock
+from ingestion import plan_tasks, stream_parsed, log_parsed, shutdown_parser_pool
+import ingestion_jobs
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from query_embedder import QueryEmbedder
+from context_builder import build_context
+from embedding_pipeline import EmbeddingPipeline, INGEST_EMBED_IN_FLIGHT
+from reranking import PostRetrieval, RERANK_CANDIDATES
+from answer_cache import AnswerCache
+from index_registry import IndexRegistry
+from executors import BoundedExecutor, RETRIEVAL_WORKERS, RETRIEVAL_MAX_PENDING
+from uploads import receive_pdfs, upload_pool
+from generation_scheduler import (
+    GenerationScheduler, QueueFull, per_worker, WEB_CONCURRENCY,
+    GENERATION_CONCURRENCY, GENERATION_MAX_QUEUE, GENERATION_MAX_QUEUED_PER_USER,
+)
+from auth import get_password_hash, authenticate_user, create_access_token, get_current_user, get_current_user_optional
 
 # Create database tables
-models.Base.metadata.create_all(bind=engine)
+with schema_lock():
+    models.Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    relax_not_null_columns()
 
 app = FastAPI(title="RAG PDF Expert API")
 
@@ -42,7 +74,9 @@ app.add_middleware(
 # In a real app, use a proper database or cache.
 # For local dev, a global var is fine.
 state = {
-    "vector_db": None
+    "indexes": None,  # IndexRegistry of per-user vector indexes, set on startup
+    "ingestion": None,  # task running ingestion jobs, in the one worker holding ingest_lock
+    "jobs_wakeup": None,  # set to start a newly created job without waiting for the next poll
 }
 
 DATA_FOLDER = "data_uploaded"
@@ -50,176 +84,525 @@ os.makedirs(DATA_FOLDER, exist_ok=True)
 
 class ChatRequest(BaseModel):
     question: str
+    # Optional ANN search knobs: higher is more accurate but slower (ignored by exact indexes)
+    nprobe: Optional[int] = Field(default=None, ge=1, le=4096)
+    ef_search: Optional[int] = Field(default=None, ge=1, le=4096)
+    # Skip the answer cache and always generate (the new answer replaces the cached one)
+    bypass_cache: bool = False
 
 class ChatResponse(BaseModel):
     answer: str
     citations: List[dict]
+    cached: bool = False
+    # Seconds spent waiting for a generation slot
+    queue_seconds: float = 0.0
 
 INDEX_FOLDER = "faiss_index"
+# Passages sent to the LLM. Hybrid retrieval finds exact-term matches that used to need k=25-40.
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "15"))
+
+embedding_cache = EmbeddingCache()
+answer_cache = AnswerCache()
+# Shared by every user's index so concurrent questions are batched together
+# One pooled, keep-alive HTTP client for every call to Ollama (see ollama_client.py)
+ollama = OllamaClient(OLLAMA_EMBED_URLS, OLLAMA_GENERATE_URLS)
+query_embedder = QueryEmbedder(PooledEmbeddings(ollama, EMBED_MODEL))
+# CPU work of chat requests (search, context building, cache lookups) runs here, off the event loop
+retrieval_pool = BoundedExecutor(RETRIEVAL_WORKERS, RETRIEVAL_MAX_PENDING, "retrieval")
+# Diversifies / filters the fused candidates before they reach the prompt (see reranking.py)
+post_retrieval = PostRetrieval()
+# Every LLM generation waits its turn here, fairly across users. GENERATION_CONCURRENCY
+# slots per generation node, split between the WEB_CONCURRENCY worker processes
+generation_scheduler = GenerationScheduler(
+    concurrency=per_worker(GENERATION_CONCURRENCY * len(ollama.generate_pool)),
+    max_queue=per_worker(GENERATION_MAX_QUEUE),
+    max_queued_per_user=per_worker(GENERATION_MAX_QUEUED_PER_USER),
+)
+if GENERATION_CONCURRENCY * len(ollama.generate_pool) < WEB_CONCURRENCY:
+    print(f"WARNING: {WEB_CONCURRENCY} workers each run at least one generation, more than "
+          f"GENERATION_CONCURRENCY={GENERATION_CONCURRENCY} per generation server; raise it with OLLAMA_NUM_PARALLEL")
+# Seconds between "queue" updates to a streaming client while it waits
+QUEUE_UPDATE_SECONDS = 1.0
+# With several workers, the one holding this lock ingests and writes the indexes
+ingest_lock = ingestion_jobs.IngestionLock()
+
+def get_embeddings():
+    """
+    Ollama embeddings backed by the on-disk embedding cache (see embedding_cache.py).
+    Questions are embedded through the shared, micro-batched query cache (see query_embedder.py).
+    """
+    return CachedEmbeddings(PooledEmbeddings(ollama, EMBED_MODEL), EMBED_MODEL, embedding_cache, query_embedder=query_embedder)
+
+def user_index_folder(user_id: Optional[int]) -> str:
+    """Each user searches only their own library. Anonymous uploads share INDEX_FOLDER."""
+    if user_id is None:
+        return INDEX_FOLDER
+    return os.path.join("data", "users", str(user_id), "vector_store")
+
+def user_documents_folder(user_id: Optional[int]) -> str:
+    if user_id is None:
+        return DATA_FOLDER
+    return os.path.join("data", "users", str(user_id), "documents")
 
 @app.on_event("startup")
 async def startup_event():
     """
-    On startup, load the existing FAISS index if it exists.
+    On startup, create the registry of per-user vector indexes (see index_registry.py).
+    The shared index is opened right away; user indexes are opened on first use.
+    A legacy FAISS.save_local folder is migrated on first open.
+    With several workers, only the one that takes ingest_lock opens indexes for writing.
     """
     global state
-    if os.path.exists(INDEX_FOLDER):
-        print("Loading existing vector store from disk...")
-        embeddings = OllamaEmbeddings(model="nomic-embed-text", base_url=OLLAMA_BASE_URL)
-        try:
-            state["vector_db"] = FAISS.load_local(INDEX_FOLDER, embeddings, allow_dangerous_deserialization=True)
-            print("Vector store loaded successfully.")
-        except Exception as e:
-            print(f"Failed to load vector store: {e}")
-    else:
-        print("No existing vector store found. Starting fresh.")
+    ingest_lock.try_acquire()
+    state["indexes"] = IndexRegistry(get_embeddings, is_writer=lambda: ingest_lock.held)
+    state["indexes"].start_janitor()
+    ollama.start_health_checks()
+    with state["indexes"].acquire(INDEX_FOLDER) as vector_db:
+        print(f"Shared vector store ready ({len(vector_db)} chunks).")
+    state["jobs_wakeup"] = asyncio.Event()
+    state["ingestion"] = asyncio.create_task(run_ingestion_jobs())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ollama.aclose()
+    retrieval_pool.shutdown()
+    upload_pool.shutdown()
+    shutdown_parser_pool()
 
-from fastapi import BackgroundTasks
+# Checking for conflicting jobs and creating the new one is one step across all workers:
+# the thread lock within this process, the file lock between processes
+registration_lock = threading.Lock()
+REGISTRATION_LOCK_FILE = os.path.join("data", "uploads.lock")
 
-@app.post("/upload")
-async def upload_files(background_tasks: BackgroundTasks, files: List[UploadFile] = File(...)):
+def register_uploads(received, user_id: Optional[int], db: Session) -> dict:
     """
-    Accepts PDF uploads, saves them, and incrementally adds them to the vector index in the background.
+    Moves received files into place and creates their ingestion job.
+    Byte-identical files are skipped; a changed file with the same name replaces its old chunks,
+    unless an unfinished job still refers to it. Returns the /upload response.
     """
-    global state
+    with registration_lock, process_lock(REGISTRATION_LOCK_FILE):
+        return _register_uploads(received, user_id, db)
+
+def _register_uploads(received, user_id: Optional[int], db: Session) -> dict:
     new_files_paths = []
+    replace_sources = []
+    hashes = {}
+    skipped = []
+    in_progress = []
+    # Duplicates are checked within the library the file is indexed into, including
+    # files of its unfinished jobs (Document rows are only written once a job succeeds)
+    user_documents = db.query(models.Document).filter(models.Document.user_id == user_id)
+    pending_files = db.query(models.IngestionJobFile).join(models.IngestionJob).filter(
+        models.IngestionJob.user_id == user_id, models.IngestionJob.status.in_(("queued", "running"))
+    )
+
+    for file in received:
+        duplicate = (
+            file.content_hash in hashes.values()
+            or user_documents.filter(models.Document.content_hash == file.content_hash).first() is not None
+            or pending_files.filter(models.IngestionJobFile.content_hash == file.content_hash).first() is not None
+        )
+        if duplicate:
+            os.remove(file.tmp_path)
+            skipped.append(file.filename)
+            print(f"Skipping {file.filename}: identical file already indexed or being indexed.")
+            continue
+        # An unfinished job still has to read the file at this path: don't swap it underneath
+        if pending_files.filter(models.IngestionJobFile.file_path == file.file_path).first() is not None:
+            os.remove(file.tmp_path)
+            in_progress.append(file.filename)
+            print(f"Rejecting {file.filename}: an earlier upload of it is still being indexed.")
+            continue
 
-    # 1. Save uploaded files to disk
-    for file in files:
-        file_path = os.path.join(DATA_FOLDER, file.filename)
-        # Check if file already exists to avoid re-processing perfectly identical uploads if desired,
-        # but technically we should allow overwrites. 
-        # For simplicity, we just overwrite and add to index (duplicates in index possible 
-        # but user can manage files). Ideally we'd check hash.
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        new_files_paths.append(file_path)
-
-    # 2. Process ONLY the new files
+        # Same name, different bytes: the old chunks must go. Files uploaded before
+        # hashes were recorded have no Document row, so also check the disk.
+        existing = user_documents.filter(models.Document.filename == file.filename).first()
+        if existing is not None or os.path.exists(file.file_path):
+            replace_sources.append(file.filename)
+
+        os.replace(file.tmp_path, file.file_path)
+        new_files_paths.append(file.file_path)
+        hashes[file.file_path] = file.content_hash
+
+    # Process ONLY the new files
     if not new_files_paths:
-        return {"status": "success", "message": "No new files uploaded."}
+        message = "No new files uploaded."
+        if in_progress:
+            message += " Files still being indexed can be uploaded again once their job finishes."
+        return {"status": "success", "message": message, "skipped": skipped, "in_progress": in_progress}
+
+    # Recorded before processing starts, so progress is visible at /jobs/{id} and survives restarts
+    job_id = ingestion_jobs.create_job(user_id, [
+        {
+            "file_path": path,
+            "content_hash": hashes[path],
+            "replaces_existing": os.path.basename(path) in replace_sources,
+        }
+        for path in new_files_paths
+    ])
+    return {
+        "status": "success",
+        "message": f"Upload accepted. Processing {len(new_files_paths)} files in background.",
+        "skipped": skipped,
+        "in_progress": in_progress,
+        "job_id": job_id,
+    }
+
+# The body is parsed by hand (see uploads.py), so describe it for the API docs
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+            "required": ["files"],
+        }}},
+    }
+}
+
+@app.post("/upload", openapi_extra=UPLOAD_OPENAPI)
+async def upload_files(
+    request: Request,
+    current_user: Optional[models.User] = Depends(get_current_user_optional),
+    db: Session = Depends(get_db),
+):
+    """
+    Accepts PDF uploads, saves them, and incrementally adds them to the vector index in the background.
+    The body is streamed to disk as it arrives, with size limits and a PDF magic-byte check
+    (see uploads.py), so a large upload neither blocks the event loop nor is buffered in memory.
+    """
+    user_id = current_user.id if current_user else None
+    received = await receive_pdfs(request, user_documents_folder(user_id))
+    response = await run_in_threadpool(register_uploads, received, user_id, db)
 
-    # Run processing in background to avoid timeout
-    background_tasks.add_task(process_new_files, new_files_paths)
+    # Processed in the background by the ingestion worker (this one, or another on its next poll)
+    if "job_id" in response:
+        state["jobs_wakeup"].set()
+    return response
 
-    return {"status": "success", "message": f"Upload accepted. Processing {len(new_files_paths)} files in background."}
+def record_documents(hashes: dict, user_id: Optional[int]):
+    """
+    Creates or updates the Document rows (with content hash) for successfully indexed files,
+    and the user's VectorStore row.
+    """
+    db = SessionLocal()
+    try:
+        for file_path, content_hash in hashes.items():
+            filename = os.path.basename(file_path)
+            doc = db.query(models.Document).filter(
+                models.Document.user_id == user_id, models.Document.filename == filename
+            ).first()
+            if doc is None:
+                doc = models.Document(user_id=user_id, filename=filename, file_path=file_path)
+                db.add(doc)
+            doc.content_hash = content_hash
+            doc.upload_date = datetime.utcnow()
+
+        if user_id is not None:
+            vector_store = db.query(models.VectorStore).filter(models.VectorStore.user_id == user_id).first()
+            if vector_store is None:
+                db.add(models.VectorStore(user_id=user_id, index_path=user_index_folder(user_id)))
+            else:
+                vector_store.updated_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+def forget_documents(file_paths: List[str], user_id: Optional[int]):
+    """
+    Removes files whose chunks a job took out of the index without indexing new ones:
+    their Document rows and the uploaded files, so they are no longer listed and the
+    same bytes can be uploaded (not skipped) again.
+    """
+    if not file_paths:
+        return
+    db = SessionLocal()
+    try:
+        db.query(models.Document).filter(
+            models.Document.user_id == user_id,
+            models.Document.filename.in_([os.path.basename(path) for path in file_paths]),
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    for path in file_paths:
+        if os.path.exists(path):
+            os.remove(path)
 
-def process_new_files(file_paths: List[str]):
+async def run_ingestion_job(job_id: int):
+    """
+    Streams the files of an ingestion job through parse -> embed -> index. Page
+    ranges are parsed in a process pool, embedded with several requests in flight,
+    and committed to the index every INGEST_COMMIT_CHUNKS chunks (or
+    INGEST_COMMIT_SECONDS), so the first pages of a book are searchable while the
+    rest is still being processed. Each stage holds a bounded amount of work, so
+    memory doesn't grow with the size of the book. Resumes from the job's
+    checkpoint if an earlier attempt was interrupted (see ingestion_jobs.py).
+    """
     import sys
     global state
-    new_docs = []
 
-    print(f"Processing {len(file_paths)} new files...")
+    job = await run_in_threadpool(ingestion_jobs.start_job, job_id)
+    if job is None:
+        return
+    user_id = job["user_id"]
+    file_paths = [f["file_path"] for f in job["files"]]
+    print(f"Job {job_id}: processing {len(file_paths)} files (attempt with {job['embedded_chunks']} chunks already embedded)...")
     sys.stdout.flush()
 
-    for pdf_file in file_paths:
-        try:
-            print(f"Loading {pdf_file}...")
-            loader = PyPDFLoader(pdf_file)
-            docs = loader.load()
-            for doc in docs:
-                doc.metadata["source"] = os.path.basename(pdf_file)
-            new_docs.extend(docs)
-            print(f"Successfully loaded {len(docs)} pages from {pdf_file}")
-            sys.stdout.flush()
-        except Exception as e:
-            print(f"Error loading {pdf_file}: {e}")
-            import traceback
-            traceback.print_exc()
-
-    if not new_docs:
-         print("ERROR: Could not extract text from uploaded files.")
-         return {"status": "error", "message": "Could not extract text from uploaded files."}
-
-    # Split
-    print(f"Splitting {len(new_docs)} documents into chunks...")
-    splitter = RecursiveCharacterTextSplitter(chunk_size=900, chunk_overlap=150)
-    chunks = splitter.split_documents(new_docs)
-    print(f"Created {len(chunks)} chunks")
-    sys.stdout.flush()
+    checkpoint = ingestion_jobs.Checkpoint(job_id)
+    counts = {}  # chunks parsed per source
+    parse_errors = {}  # source -> first page range that failed; the whole file fails
+    # Sources whose old chunks the next commit holding any of their chunks deletes. Includes
+    # this job's own files, so chunks an interrupted attempt indexed are replaced too.
+    sources = [os.path.basename(path) for path in file_paths]
+    replace = set(sources)
+    replaces_existing = {os.path.basename(f["file_path"]) for f in job["files"] if f["replaces_existing"]}
+    embedded = 0
+    indexed_per_source = Counter()
+    committed = False  # every chunk is in the index
+
+    def commit(chunks, vectors, delete_sources):
+        with state["indexes"].acquire(user_index_folder(user_id)) as vector_db:
+            vector_db.add_documents(chunks, vectors=vectors, delete_sources=delete_sources)
+
+    async def parsed_chunks(tasks):
+        """(chunk, digest) in chunk order, recording parse progress after each page range."""
+        tasks_left = Counter(pdf_file for pdf_file, _, _ in tasks)
+        parsed_pages = 0
+        fingerprint = hashlib.sha256()
+        async with aclosing(stream_parsed(tasks)) as parsed:
+            async for (pdf_file, start, end), pages, chunks, error in parsed:
+                log_parsed(pdf_file, start, end, pages, chunks, error)
+                parsed_pages += max(end - start, 0)
+                tasks_left[pdf_file] -= 1
+                source = os.path.basename(pdf_file)
+                if error and source not in parse_errors:
+                    parse_errors[source] = f"Pages {start}-{end} could not be parsed: {error}"
+                if source in parse_errors:
+                    chunks = []  # not worth embedding: the file won't be indexed
+                for chunk in chunks:
+                    counts[chunk.metadata["source"]] = counts.get(chunk.metadata["source"], 0) + 1
+                digests = [ingestion_jobs.chunk_digest(chunk) for chunk in chunks]
+                fingerprint.update(b"".join(digests))
+                finished = [os.path.basename(path) for path, left in tasks_left.items() if not left]
+                await run_in_threadpool(ingestion_jobs.record_parsed, job_id, dict(counts), parsed_pages, finished, parse_errors)
+                for item in zip(chunks, digests):
+                    yield item
+        await run_in_threadpool(ingestion_jobs.record_parsed, job_id, dict(counts), parsed_pages,
+                                sources, parse_errors, fingerprint.hexdigest())
+        print(f"Created {sum(counts.values())} chunks")
+
+    async def embedded_batches(tasks):
+        """
+        (chunks, vectors) in chunk order: first the checkpointed vectors, for as long as
+        the chunks still match the checkpoint, then new embeddings, checkpointed as they arrive.
+        """
+        nonlocal embedded
+        async with aclosing(parsed_chunks(tasks)) as stream:
+            resume_at = None  # the first chunk the checkpoint doesn't cover
+            while embedded < checkpoint.rows and resume_at is None:
+                vectors, expected = await run_in_threadpool(checkpoint.read, embedded, ingestion_jobs.INGEST_BATCH_SIZE)
+                matched = []
+                for digest in expected:
+                    item = await anext(stream, None)
+                    if item is None or item[1] != digest:
+                        resume_at = item
+                        break
+                    matched.append(item[0])
+                if matched:
+                    embedded += len(matched)
+                    yield matched, vectors[:len(matched)]
+                if len(matched) < len(expected):
+                    break
+            if embedded < checkpoint.rows:
+                print(f"Job {job_id}: files changed since the last attempt, embedding again from chunk {embedded}")
+                await run_in_threadpool(checkpoint.truncate, embedded)
+                await run_in_threadpool(ingestion_jobs.record_progress, job_id, embedded, checkpoint.dim)
+            elif embedded:
+                print(f"Resumed {embedded} chunks from the checkpoint")
+
+            # Embed the rest with several requests in flight (see embedding_pipeline.py)
+            queued = deque()  # chunks handed to the pipeline, not yet embedded
+            async def texts():
+                if resume_at is not None:
+                    queued.append(resume_at)
+                    yield resume_at[0].page_content
+                async for item in stream:
+                    queued.append(item)
+                    yield item[0].page_content
+
+            pipeline = EmbeddingPipeline(
+                get_embeddings().aembed_documents,
+                in_flight=INGEST_EMBED_IN_FLIGHT or 2 * len(ollama.embed_pool),
+                batch_size=ingestion_jobs.INGEST_BATCH_SIZE,
+            )
+            async with aclosing(texts()) as source:
+                async for batch_vectors in pipeline.embed(source):
+                    items = [queued.popleft() for _ in batch_vectors]
+                    await run_in_threadpool(checkpoint.append, batch_vectors, [digest for _, digest in items])
+                    embedded += len(items)
+                    await run_in_threadpool(ingestion_jobs.record_progress, job_id, embedded, len(batch_vectors[0]))
+                    print(f"Embedded {embedded} chunks (batch of {len(items)})")
+                    yield [chunk for chunk, _ in items], batch_vectors
+            print(f"Embedding: {pipeline.stats()}")
 
-    # Embed & Index - Process in batches to handle large PDFs
     try:
-        print("Creating embeddings...")
-        embeddings = OllamaEmbeddings(model="nomic-embed-text", base_url=OLLAMA_BASE_URL)
-        
-        # Process in batches of 100 chunks to avoid timeout/memory issues
-        batch_size = 100
-        total_batches = (len(chunks) + batch_size - 1) // batch_size
-        
-        if state["vector_db"] is None:
-            # Create new index with first batch
-            print(f"Creating new vector store (processing {len(chunks)} chunks in {total_batches} batches)...")
-            first_batch = chunks[:batch_size]
-            vector_db = FAISS.from_documents(first_batch, embeddings)
-            state["vector_db"] = vector_db
-            print(f"Batch 1/{total_batches} complete")
-            
-            # Add remaining batches
-            for i in range(batch_size, len(chunks), batch_size):
-                batch_num = (i // batch_size) + 1
-                batch = chunks[i:i + batch_size]
-                state["vector_db"].add_documents(batch)
-                print(f"Batch {batch_num}/{total_batches} complete")
-        else:
-            # Add to existing index in batches
-            print(f"Adding to existing vector store ({len(chunks)} chunks in {total_batches} batches)...")
-            for i in range(0, len(chunks), batch_size):
-                batch_num = (i // batch_size) + 1
-                batch = chunks[i:i + batch_size]
-                state["vector_db"].add_documents(batch)
-                print(f"Batch {batch_num}/{total_batches} complete")
-
-        # Save to disk
-        print("Saving vector store to disk...")
-        state["vector_db"].save_local(INDEX_FOLDER)
-        print(f"SUCCESS: Added {len(file_paths)} files ({len(chunks)} chunks) to the index.")
+        tasks = await run_in_threadpool(plan_tasks, file_paths)
+        total_pages = sum(max(end - start, 0) for _, start, end in tasks)
+        print(f"Parsing {len(file_paths)} files ({total_pages} pages) as {len(tasks)} tasks...")
+        await run_in_threadpool(ingestion_jobs.record_plan, job_id, total_pages)
+        await run_in_threadpool(checkpoint.open, job["embedded_chunks"], job["embedding_dim"])
+
+        # Commit in pieces as batches arrive. A source's first commit in this attempt
+        # deletes its old chunks in the same step, so it never shows twice.
+        pending_chunks, pending_vectors = [], []
+        last_commit = time.monotonic()
+        async def flush(final: bool = False):
+            nonlocal last_commit
+            # Files that failed to parse are kept out, and on the last commit taken out again
+            keep = [i for i, c in enumerate(pending_chunks) if c.metadata["source"] not in parse_errors]
+            chunks = [pending_chunks[i] for i in keep]
+            if final:
+                delete = sorted(replace | set(parse_errors))
+            else:
+                delete = sorted(replace & {c.metadata["source"] for c in chunks})
+            if not chunks and not delete:
+                return
+            vectors = np.concatenate(pending_vectors)[keep] if chunks else None
+            await run_in_threadpool(commit, chunks, vectors, delete)
+            replace.difference_update(delete)
+            for source in delete:
+                indexed_per_source.pop(source, None)
+            indexed_per_source.update(c.metadata["source"] for c in chunks)
+            indexed = sum(indexed_per_source.values())
+            await run_in_threadpool(ingestion_jobs.record_indexed, job_id, indexed)
+            print(f"Indexed {indexed} chunks")
+            for source in replaces_existing.intersection(delete):
+                print(f"Replacing {source}: old chunks removed")
+            pending_chunks.clear()
+            pending_vectors.clear()
+            last_commit = time.monotonic()
+
+        async with aclosing(embedded_batches(tasks)) as batches:
+            async for chunks, vectors in batches:
+                pending_chunks.extend(chunks)
+                pending_vectors.append(np.asarray(vectors, dtype=np.float32))
+                if (len(pending_chunks) >= ingestion_jobs.INGEST_COMMIT_CHUNKS
+                        or time.monotonic() - last_commit >= ingestion_jobs.INGEST_COMMIT_SECONDS):
+                    await flush()
+        sys.stdout.flush()
+
+        if not any(n for source, n in counts.items() if source not in parse_errors):
+            raise ValueError("; ".join(parse_errors.values()) or "Could not extract text from uploaded files.")
+
+        # Last commit: the remaining chunks, and the old chunks of replaced files that produced none this time
+        await flush(final=True)
+        committed = True
+        hashes = {f["file_path"]: f["content_hash"] for f in job["files"]
+                  if f["content_hash"] and indexed_per_source[os.path.basename(f["file_path"])]}
+        if hashes:
+            await run_in_threadpool(record_documents, hashes, user_id)
+        # Files that failed to parse lost their old chunks in the last commit
+        await run_in_threadpool(forget_documents, [path for path in file_paths if os.path.basename(path) in parse_errors], user_id)
+        await run_in_threadpool(ingestion_jobs.finish_job, job_id)
+        await run_in_threadpool(checkpoint.remove)
+        added = [source for source in sources if indexed_per_source[source]]
+        print(f"SUCCESS: Added {len(added)} of {len(file_paths)} files ({sum(indexed_per_source.values())} chunks) to the index.")
+        print(f"Embedding cache: {embedding_cache.stats()}")
         sys.stdout.flush()
     except Exception as e:
         print(f"ERROR during indexing: {e}")
         import traceback
         traceback.print_exc()
-        return {"status": "error", "message": f"Indexing failed: {str(e)}"}
-    
-    return {"status": "success", "message": f"Added {len(file_paths)} files ({len(chunks)} chunks) to the index."}
+        if indexed_per_source and not committed:
+            # Don't leave a partial book searchable: take back what this attempt indexed.
+            # Once everything is committed, a bookkeeping error leaves the (complete) index alone.
+            touched = sorted(set(sources) - replace)
+            try:
+                await run_in_threadpool(commit, [], None, touched)
+                await run_in_threadpool(ingestion_jobs.record_indexed, job_id, 0)
+            except Exception as rollback_error:
+                print(f"Could not remove partially indexed files {touched}: {rollback_error}")
+            # Their old chunks went with this attempt's first commit, so they are no longer indexed
+            try:
+                await run_in_threadpool(forget_documents, [path for path in file_paths if os.path.basename(path) in touched], user_id)
+            except Exception as forget_error:
+                print(f"Could not forget removed files {touched}: {forget_error}")
+        # A failed job is not resumed, so its checkpoint is of no further use
+        try:
+            await run_in_threadpool(checkpoint.remove)
+        except OSError as remove_error:
+            print(f"Could not remove checkpoint of job {job_id}: {remove_error}")
+        await run_in_threadpool(ingestion_jobs.finish_job, job_id, f"Indexing failed: {str(e)}")
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    print("--- ENTERING CHAT ENDPOINT ---")
-    try:
-        if state["vector_db"] is None:
-            raise HTTPException(status_code=400, detail="No documents indexed. Please upload files first.")
-        
-        vector_db = state["vector_db"]
-        llm = ChatOllama(model="mistral", base_url=OLLAMA_BASE_URL)
+def become_ingestion_worker() -> bool:
+    """Takes ingest_lock if no other worker holds it. The first time, open indexes become writable."""
+    if ingest_lock.held:
+        return True
+    if not ingest_lock.try_acquire():
+        return False
+    print(f"Worker {os.getpid()} took over ingestion")
+    state["indexes"].promote()
+    return True
 
-        # 1. Retrieve - Improved k=25
-        import time
-        t0 = time.time()
-        print("Retrieving docs...")
-        docs_and_scores = vector_db.similarity_search_with_score(request.question, k=25)
-        docs_and_scores.sort(key=lambda x: x[1])
-        source_docs = [doc for doc, score in docs_and_scores]
-        print(f"Retrieval took: {time.time() - t0:.2f}s")
-        
-        # 2. Context - Format as numbered source passages
-        context_parts = []
-        for idx, d in enumerate(source_docs, 1):
-            src = d.metadata.get("source", "Unknown")
-            pg = d.metadata.get("page", 0) + 1
-            context_parts.append(f"[{src}, p.{pg}]:\n{d.page_content}")
-        context = "\n\n---\n\n".join(context_parts)
-        
-        # Debug: Log what we're sending to the AI
-        print(f"Retrieved {len(source_docs)} passages")
-        print(f"Context length: {len(context)} characters")
-        print(f"First passage preview: {context[:500]}...")
-        # sys.stdout.flush() - Removed to prevent potential NameError
+async def run_ingestion_jobs():
+    """
+    Runs queued and unfinished jobs (including those interrupted by the last shutdown
+    or crash, which continue from their checkpoints), then waits for new ones. Jobs on
+    the same library run one at a time, in upload order, so a later upload of a file
+    always lands after an earlier one; different libraries are ingested concurrently.
+    Only the worker holding ingest_lock runs jobs; the others keep trying to take it over.
+    """
+    running = {}  # index folder -> task of the job running on it
 
-        # 3. Prompt - 4-Step Deep Analysis
-        prompt = f"""You are an expert research assistant.
+    def job_done(folder):
+        running.pop(folder, None)
+        state["jobs_wakeup"].set()  # start the library's next job now
+
+    while True:
+        try:
+            if await run_in_threadpool(become_ingestion_worker):
+                for job_id, user_id in await run_in_threadpool(ingestion_jobs.unfinished_jobs):
+                    folder = user_index_folder(user_id)
+                    if folder not in running:
+                        running[folder] = asyncio.create_task(run_ingestion_job(job_id))
+                        running[folder].add_done_callback(lambda _, folder=folder: job_done(folder))
+        except Exception as e:
+            print(f"Ingestion dispatch failed: {e}")
+        try:
+            await asyncio.wait_for(state["jobs_wakeup"].wait(), timeout=ingestion_jobs.INGEST_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        state["jobs_wakeup"].clear()
 
-QUERY: {request.question}
+def retrieve_sources(vector_db, question: str, k: int = RETRIEVAL_K, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                     embedding: Optional[List[float]] = None):
+    """
+    Retrieves the top-k passages for a question (hybrid BM25 + vector search, then the
+    post-retrieval stages) and formats them as numbered source passages.
+    Returns (docs_and_scores, context), best first.
+    """
+    docs_and_scores = vector_db.hybrid_search_with_score(
+        question, k=k, nprobe=nprobe, ef_search=ef_search, embedding=embedding,
+        rerank=post_retrieval, rerank_candidates=RERANK_CANDIDATES,
+    )
+    source_docs = [doc for doc, score in docs_and_scores]
+
+    # Overlapping chunks of a page are merged and near-duplicates dropped, within a token budget
+    context, stats = build_context(source_docs)
+    saved = stats["tokens_before"] - stats["tokens_after"]
+    print(
+        f"Context: {stats['passages']} passages -> {stats['blocks_used']}/{stats['blocks']} blocks, "
+        f"~{stats['tokens_before']} -> ~{stats['tokens_after']} tokens (saved ~{saved})"
+    )
+    return docs_and_scores, context
+
+def build_prompt(question: str, context: str) -> str:
+    # 4-Step Deep Analysis
+    return f"""You are an expert research assistant.
+
+QUERY: {question}
 
 SOURCE MATERIAL:
 {context}
@@ -255,68 +638,335 @@ CRITICAL CITATION RULES:
 
     """.strip()
 
-        # 4. Infer
-        print("Invoking LLM (Sync)...")
+def format_citations(docs_and_scores, answer_text: str) -> List[dict]:
+    """Only include sources actually cited in the response."""
+    citations = []
+    for d, score in docs_and_scores:
+        source_name = d.metadata.get("source", "Unknown")
+        page_num = d.metadata.get("page", 0) + 1
+
+        # Check if this source was actually referenced in the answer
+        # Look for patterns like "[source, p.XX]" or "source, p.XX"
+        if source_name.replace('.pdf', '') in answer_text or f"p.{page_num}" in answer_text:
+            citations.append({
+                "source": source_name,
+                "page": page_num,
+                "score": float(score),
+                "text": d.page_content
+            })
+    return citations
+
+def log_chat_error(e: Exception):
+    error_msg = f"Chat Error: {str(e)}\n"
+    import traceback
+    traceback_str = traceback.format_exc()
+    print(error_msg)
+    print(traceback_str)
+
+    # Write to file to ensure we catch it
+    with open("backend_error.log", "w") as f:
+        f.write(error_msg)
+        f.write(traceback_str)
+
+def retrieve_for_user(user_id: Optional[int], request: ChatRequest, question_vector: List[float], k: int = RETRIEVAL_K):
+    """
+    Retrieves from the user's own index. Raises 400 if it has no documents yet.
+    The question is embedded by the caller (asynchronously), so this is local work only.
+    Returns (docs_and_scores, context, index_version).
+    """
+    with state["indexes"].acquire(user_index_folder(user_id)) as vector_db:
+        # One snapshot for the whole retrieval: a concurrent ingestion is either fully visible or not at all
+        with vector_db.snapshot() as snapshot:
+            if len(snapshot) == 0:
+                raise HTTPException(status_code=400, detail="No documents indexed. Please upload files first.")
+            index_version = snapshot.content_version
+            docs_and_scores, context = retrieve_sources(
+                snapshot, request.question, k=k, nprobe=request.nprobe, ef_search=request.ef_search, embedding=question_vector,
+            )
+    return docs_and_scores, context, index_version
+
+def library_size(user_id: Optional[int]) -> int:
+    """Number of chunks in the user's index (opening it if needed)."""
+    with state["indexes"].acquire(user_index_folder(user_id)) as vector_db:
+        with vector_db.snapshot() as snapshot:
+            return len(snapshot)
+
+def scheduler_key(user_id: Optional[int], http_request: Request) -> str:
+    """Fair-queuing identity: the account, or the client address for anonymous callers."""
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"anonymous:{http_request.client.host if http_request.client else ''}"
+
+def check_admission(user_key: str):
+    """Sheds the request with 429 if the generation queue has no room for it right now."""
+    try:
+        generation_scheduler.check_admission(user_key)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def admit(user_key: str):
+    """Takes a place in the generation queue, or sheds the request with 429 if it is full."""
+    try:
+        return generation_scheduler.submit(user_key)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def answer_scope(user_id: Optional[int]) -> str:
+    return f"user:{user_id}" if user_id is not None else "anonymous"
+
+def lookup_answer(user_id: Optional[int], index_version: int, question: str, question_vector: List[float], docs_and_scores) -> Optional[dict]:
+    """Returns a cached answer generated from the same library and passages (see answer_cache.py), or None."""
+    chunk_ids = [d.id for d, _ in docs_and_scores]
+    return answer_cache.get(answer_scope(user_id), index_version, question, chunk_ids, question_vector)
+
+def store_answer(user_id: Optional[int], index_version: int, question: str, question_vector: List[float],
+                 docs_and_scores, answer_text: str, citations: List[dict]):
+    if not answer_text.strip():
+        return
+    chunk_ids = [d.id for d, _ in docs_and_scores]
+    answer_cache.put(answer_scope(user_id), index_version, question, chunk_ids, question_vector, answer_text, citations)
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, http_request: Request, current_user: Optional[models.User] = Depends(get_current_user_optional)):
+    print("--- ENTERING CHAT ENDPOINT ---")
+    user_id = current_user.id if current_user else None
+    user_key = scheduler_key(user_id, http_request)
+    # Shed with 429 before any work is done; the queue place is taken only after a cache miss,
+    # so retrieval doesn't hold a generation slot and cache hits never wait
+    check_admission(user_key)
+    ticket = None
+    generation_seconds = None  # set once the model has answered
+    try:
+        # 1. Retrieve - Improved k=25
+        # 2. Context - Format as numbered source passages
+        import time
+        t0 = time.time()
+        print("Retrieving docs...")
+        question_vector = await query_embedder.aembed_query(request.question)
+        docs_and_scores, context, index_version = await retrieval_pool.run(retrieve_for_user, user_id, request, question_vector)
+        print(f"Retrieval took: {time.time() - t0:.2f}s")
+
+        if not request.bypass_cache:
+            cached = await retrieval_pool.run(lookup_answer, user_id, index_version, request.question, question_vector, docs_and_scores)
+            if cached:
+                print(f"Answer cache hit ({cached['match']}, similarity {cached['similarity']:.3f})")
+                return ChatResponse(answer=cached["answer"], citations=cached["citations"], cached=True)
+        
+        # Debug: Log what we're sending to the AI
+        print(f"Retrieved {len(docs_and_scores)} passages")
+        print(f"Context length: {len(context)} characters")
+        print(f"First passage preview: {context[:500]}...")
+        # sys.stdout.flush() - Removed to prevent potential NameError
+
+        # 3. Prompt - 4-Step Deep Analysis
+        prompt = build_prompt(request.question, context)
+
+        # 4. Infer, once the scheduler gives this request a generation slot
+        t_queue = time.time()
+        ticket = admit(user_key)
+        await ticket.wait()
+        queue_seconds = time.time() - t_queue
+        print(f"Invoking LLM (waited {queue_seconds:.2f}s in queue)...")
         t1 = time.time()
-        from fastapi.concurrency import run_in_threadpool
         try:
-            # Use run_in_threadpool for sync functions called from async
-            response = await run_in_threadpool(llm.invoke, prompt)
-            print(f"LLM Generation took: {time.time() - t1:.2f}s")
-            answer_text = response.content
+            answer_text = await ollama.achat(CHAT_MODEL, prompt)
+            generation_seconds = time.time() - t1
+            print(f"LLM Generation took: {generation_seconds:.2f}s")
+        except httpx.TimeoutException as e:
+            print(f"LLM timed out: {e!r}")
+            raise HTTPException(status_code=504, detail="The model took too long to respond. Please try again.")
         except Exception as e:
             print(f"Error invoking LLM: {e}")
             raise HTTPException(status_code=500, detail=str(e))
 
         # 5. Format Citations - Only include sources actually cited in the response
-        citations = []
-        for d, score in docs_and_scores:
-            source_name = d.metadata.get("source", "Unknown")
-            page_num = d.metadata.get("page", 0) + 1
-            
-            # Check if this source was actually referenced in the answer
-            # Look for patterns like "[source, p.XX]" or "source, p.XX"
-            if source_name.replace('.pdf', '') in answer_text or f"p.{page_num}" in answer_text:
-                citations.append({
-                    "source": source_name,
-                    "page": page_num,
-                    "score": float(score),
-                    "text": d.page_content
-                })
+        citations = format_citations(docs_and_scores, answer_text)
+        await retrieval_pool.run(store_answer, user_id, index_version, request.question, question_vector, docs_and_scores, answer_text, citations)
 
-        return ChatResponse(answer=answer_text, citations=citations)
+        return ChatResponse(answer=answer_text, citations=citations, queue_seconds=round(queue_seconds, 2))
 
     except HTTPException:
         raise
     except Exception as e:
-        error_msg = f"Chat Error: {str(e)}\n"
-        import traceback
-        traceback_str = traceback.format_exc()
-        print(error_msg)
-        print(traceback_str)
-        
-        # Write to file to ensure we catch it
-        with open("backend_error.log", "w") as f:
-            f.write(error_msg)
-            f.write(traceback_str)
-            
+        log_chat_error(e)
         raise HTTPException(status_code=500, detail=f"Internal Error: {str(e)}")
+    finally:
+        if ticket is not None:
+            generation_scheduler.release(ticket, generation_seconds)
+
+def sse_event(event: str, data) -> str:
+    """Formats one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request, current_user: Optional[models.User] = Depends(get_current_user_optional)):
+    """
+    Streaming variant of /chat using Server-Sent Events.
+
+    Events, in order:
+      - "sources":   the retrieved passages (source, page, score), sent before generation starts
+      - "queue":     {"position", "estimated_wait_seconds"} while waiting for a generation slot,
+                     sent again whenever the position changes (position 0 = next in line)
+      - "token":     one event per chunk of text generated by the LLM
+      - "citations": the final citation list, filtered against the full answer
+      - "done":      end of stream ({"cached": true} if the answer came from the answer cache,
+                     in which case it arrives as a single "token" event)
+    An "error" event is sent instead if anything fails. Closing the connection cancels generation.
+    If the generation queue is full the request is refused up front with 429 and Retry-After.
+    """
+    print("--- ENTERING CHAT STREAM ENDPOINT ---")
+    user_id = current_user.id if current_user else None
+    user_key = scheduler_key(user_id, http_request)
+    # Checked before the stream starts so an empty library or a full queue is a plain HTTP error
+    if await retrieval_pool.run(library_size, user_id) == 0:
+        raise HTTPException(status_code=400, detail="No documents indexed. Please upload files first.")
+    check_admission(user_key)
 
+    async def event_stream():
+        import time
+        ticket = None
+        generation_seconds = None  # set once the whole answer has been streamed
+        try:
+            t0 = time.time()
+            question_vector = await query_embedder.aembed_query(request.question)
+            docs_and_scores, context, index_version = await retrieval_pool.run(retrieve_for_user, user_id, request, question_vector)
+            print(f"Retrieval took: {time.time() - t0:.2f}s")
+
+            yield sse_event("sources", {
+                "passages": [
+                    {
+                        "source": d.metadata.get("source", "Unknown"),
+                        "page": d.metadata.get("page", 0) + 1,
+                        "score": float(score),
+                    }
+                    for d, score in docs_and_scores
+                ]
+            })
+
+            if not request.bypass_cache:
+                cached = await retrieval_pool.run(lookup_answer, user_id, index_version, request.question, question_vector, docs_and_scores)
+                if cached:
+                    print(f"Answer cache hit ({cached['match']}, similarity {cached['similarity']:.3f})")
+                    yield sse_event("token", {"content": cached["answer"]})
+                    yield sse_event("citations", {"citations": cached["citations"]})
+                    yield sse_event("done", {"cached": True})
+                    return
+
+            # Taken inside the stream so the slot is always released by the finally below
+            try:
+                ticket = generation_scheduler.submit(user_key)
+            except QueueFull as e:
+                yield sse_event("error", {"detail": str(e), "retry_after": e.retry_after})
+                return
+            last_position = None
+            while not ticket.granted.done():
+                position = ticket.position()
+                if position != last_position:
+                    last_position = position
+                    yield sse_event("queue", {
+                        "position": position,
+                        "estimated_wait_seconds": round(ticket.estimated_wait(), 1),
+                    })
+                if not await ticket.wait(QUEUE_UPDATE_SECONDS) and await http_request.is_disconnected():
+                    print("Client disconnected while queued.")
+                    return
+
+            prompt = build_prompt(request.question, context)
+            answer_parts = []
+            t1 = time.time()
+            # aclosing: leaving early (disconnect) closes the upstream stream right away, not at GC
+            async with aclosing(ollama.astream_chat(CHAT_MODEL, prompt)) as pieces:
+                async for piece in pieces:
+                    if await http_request.is_disconnected():
+                        print("Client disconnected, cancelling generation.")
+                        return
+                    answer_parts.append(piece)
+                    yield sse_event("token", {"content": piece})
+            generation_seconds = time.time() - t1
+            print(f"LLM Generation took: {generation_seconds:.2f}s")
+
+            answer_text = "".join(answer_parts)
+            citations = format_citations(docs_and_scores, answer_text)
+            # Cached before the last events: a client may close the stream as soon as it sees "done"
+            await retrieval_pool.run(store_answer, user_id, index_version, request.question, question_vector, docs_and_scores, answer_text, citations)
+            yield sse_event("citations", {"citations": citations})
+            yield sse_event("done", {})
+        except Exception as e:
+            log_chat_error(e)
+            yield sse_event("error", {"detail": f"Internal Error: {str(e)}"})
+        finally:
+            if ticket is not None:
+                generation_scheduler.release(ticket, generation_seconds)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# async so the liveness probe is answered on the loop, never queued behind threadpool work
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    return {
+        "indexes": state["indexes"].metrics(),
+        "embedding_cache": embedding_cache.stats(),
+        "query_embeddings": query_embedder.stats(),
+        "answer_cache": answer_cache.stats(),
+        "retrieval_pool": retrieval_pool.stats(),
+        "upload_pool": upload_pool.stats(),
+        "generation": generation_scheduler.stats(),
+        "ollama": ollama.stats(),
+        "worker": {"pid": os.getpid(), "ingestion": ingest_lock.held},
+    }
+
+@app.get("/chat/queue")
+async def chat_queue(http_request: Request, current_user: Optional[models.User] = Depends(get_current_user_optional)):
+    """
+    Generation queue status for the caller: positions of their waiting
+    questions and the estimated wait for a new one.
+    """
+    user_key = scheduler_key(current_user.id if current_user else None, http_request)
+    waiting = generation_scheduler.waiting_for(user_key)
+    stats = generation_scheduler.stats()
+    return {
+        "active": stats["active"],
+        "queued": stats["queued"],
+        "your_positions": [ticket.position() for ticket in waiting],
+        "estimated_wait_seconds": stats["estimated_wait_seconds"],
+    }
+
+@app.get("/jobs/{job_id}", response_model=schemas.IngestionJobResponse)
+def get_job(job_id: int, current_user: Optional[models.User] = Depends(get_current_user_optional), db: Session = Depends(get_db)):
+    """
+    Progress of an ingestion job started by /upload: overall status, chunks
+    embedded so far, and per-file status.
+    """
+    job = db.get(models.IngestionJob, job_id)
+    # Jobs are only visible to their owner (anonymous jobs to anonymous callers)
+    if job is None or job.user_id != (current_user.id if current_user else None):
+        raise HTTPException(status_code=404, detail="Job not found")
+    response = schemas.IngestionJobResponse.model_validate(job)
+    # total_chunks only counts what has been parsed so far, so scale by the share of pages parsed
+    parsed = job.parsed_pages / job.total_pages if job.total_pages else 1.0
+    response.progress = round(min(job.embedded_chunks / job.total_chunks, 1.0) * parsed, 4) if job.total_chunks else 0.0
+    return response
+
 @app.get("/list-documents")
-def list_documents():
+def list_documents(current_user: Optional[models.User] = Depends(get_current_user_optional)):
     """
-    Returns a list of all uploaded PDF files in the database.
+    Returns a list of the caller's uploaded PDF files.
     """
     import os
+    documents_folder = user_documents_folder(current_user.id if current_user else None)
     files = []
-    if os.path.exists(DATA_FOLDER):
-        for filename in os.listdir(DATA_FOLDER):
+    if os.path.exists(documents_folder):
+        for filename in os.listdir(documents_folder):
             if filename.endswith('.pdf'):
-                filepath = os.path.join(DATA_FOLDER, filename)
+                filepath = os.path.join(documents_folder, filename)
                 file_size = os.path.getsize(filepath)
                 files.append({
                     "filename": filename,
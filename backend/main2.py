@@ -7,7 +7,8 @@ from dotenv import load_dotenv  # To load environment variables (not strictly ne
 from langchain_ollama import ChatOllama, OllamaEmbeddings  # The AI components (Brain + Vectorizer)
 from langchain_community.document_loaders import PyPDFLoader  # Tool to read PDF files
 from langchain_text_splitters import RecursiveCharacterTextSplitter  # Tool to cut text into small pieces
-from langchain_community.vectorstores import FAISS  # The database specifically for storing vectors (Fast AI Similarity Search)
+from index_store import SegmentedIndex  # The database for storing vectors (FAISS - Fast AI Similarity Search) and chunk text
+from embedding_cache import CachedEmbeddings  # On-disk cache so we never embed the same text twice
 
 # Load existing environment variables (if any)
 load_dotenv()
@@ -33,19 +34,23 @@ def start_rag():
     # We use 'nomic-embed-text' here instead of 'llama3'.
     # Why? 'nomic' is a specialized model just for turning text into numbers.
     # It is ~20x faster than Llama3 for this specific task and often more accurate for search.
-    embeddings = OllamaEmbeddings(model="nomic-embed-text")
+    # CachedEmbeddings remembers every vector on disk, so rebuilding the index
+    # only sends text we have never embedded before to Ollama.
+    embeddings = CachedEmbeddings(OllamaEmbeddings(model="nomic-embed-text"), "nomic-embed-text")
 
     # =============================================================================
     # 4. MEMORY CHECK (Persistence)
     # Check if we have already read and saved this book before.
     # =============================================================================
-    if os.path.exists(DB_PATH):
-        print(f"Loading existing index from {DB_PATH}...")
-        # LOAD: If the folder exists, load the "brain" instantly from disk.
+    # SegmentedIndex keeps vectors in FAISS files and chunk text in a small SQLite
+    # file (no pickle), and converts an old FAISS.save_local folder the first time.
+    vector_db = SegmentedIndex.open(DB_PATH, embeddings, compact_in_background=False)
+    if len(vector_db) > 0:
+        print(f"Loaded existing index from {DB_PATH}...")
+        # LOAD: If the index has chunks, it opens instantly from disk.
         # This skips the slow PDF reading process completely.
-        vector_db = FAISS.load_local(DB_PATH, embeddings, allow_dangerous_deserialization=True)
     else:
-        # CREATE: If no saved folder, we must process the PDF from scratch.
+        # CREATE: If the index is empty, we must process the PDF from scratch.
         print("Index not found. Creating new one with fast embeddings...")
         
         # A. LOAD: Read the raw text from the PDF file
@@ -59,21 +64,17 @@ def start_rag():
         splitter = RecursiveCharacterTextSplitter(chunk_size=900, chunk_overlap=150)
         chunks = splitter.split_documents(docs)
 
-        # C. EMBED & INDEX: Convert chunks into numbers (vectors) and store them
+        # C. EMBED, INDEX & SAVE: Convert chunks into numbers (vectors) and write them to disk
+        # so we never have to do step A-B again
         print("Creating embeddings + FAISS index (using nomic-embed-text)...")
-        vector_db = FAISS.from_documents(chunks, embeddings)
-        
-        # D. SAVE: Save this processed data to the hard drive so we never have to do step A-C again
-        vector_db.save_local(DB_PATH)
+        vector_db.add_documents(chunks)
         print(f"Index saved to {DB_PATH}")
 
     # =============================================================================
     # 5. RETRIEVAL SETUP
-    # Configure how we want to search the database
     # =============================================================================
-    # "k=10" means "Find the top 10 most relevant chunks for every question"
-    retriever = vector_db.as_retriever(search_kwargs={"k": 10})
-    
+    # We search for the top 10 most relevant chunks for every question (k=10, see step 7a).
+
     # =============================================================================
     # 6. LLM SETUP (The "Brain")
     # =============================================================================
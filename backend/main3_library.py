@@ -2,9 +2,9 @@ import os
 import glob
 from dotenv import load_dotenv
 from langchain_ollama import ChatOllama, OllamaEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
+from index_store import SegmentedIndex
+from ingestion import load_and_split
+from embedding_cache import CachedEmbeddings
 
 load_dotenv()
 
@@ -29,11 +29,12 @@ def get_page_offset(filename):
 def start_rag():
     print(f"Initializing Library RAG (Scanning '{DATA_FOLDER}' for PDFs)...")
     
-    embeddings = OllamaEmbeddings(model="nomic-embed-text")
+    # Cached: rebuilding the library only embeds chunks we haven't seen before
+    embeddings = CachedEmbeddings(OllamaEmbeddings(model="nomic-embed-text"), "nomic-embed-text")
 
-    if os.path.exists(DB_PATH):
-        print(f"Loading existing library index from {DB_PATH}...")
-        vector_db = FAISS.load_local(DB_PATH, embeddings, allow_dangerous_deserialization=True)
+    vector_db = SegmentedIndex.open(DB_PATH, embeddings, compact_in_background=False)
+    if len(vector_db) > 0:
+        print(f"Loaded existing library index from {DB_PATH}...")
     else:
         print("Index not found. Building new library index...")
         
@@ -44,33 +45,17 @@ def start_rag():
             print(f"No PDF files found in {DATA_FOLDER}/")
             return
 
-        all_docs = []
-        
-        # 2. Load each PDF
+        # 2. Load & 3. Split each PDF (in parallel, one process per core)
         print(f"Found {len(pdf_files)} books: {[os.path.basename(f) for f in pdf_files]}")
-        for i, pdf_file in enumerate(pdf_files, 1):
-            print(f"[{i}/{len(pdf_files)}] Loading: {os.path.basename(pdf_file)}...")
-            loader = PyPDFLoader(pdf_file)
-            book_docs = loader.load()
-            all_docs.extend(book_docs)
-
-        print(f"Total pages loaded: {len(all_docs)}")
-
-        # 3. Split
-        print("Splitting into chunks...")
-        splitter = RecursiveCharacterTextSplitter(chunk_size=900, chunk_overlap=150)
-        chunks = splitter.split_documents(all_docs)
+        chunks = load_and_split(pdf_files)
         print(f"Total chunks created: {len(chunks)}")
 
-        # 4. Embed & Index
+        # 4. Embed, Index & 5. Save
         print("Creating embeddings + FAISS index (using nomic-embed-text)...")
-        vector_db = FAISS.from_documents(chunks, embeddings)
-        
-        # 5. Save
-        vector_db.save_local(DB_PATH)
+        vector_db.add_documents(chunks)
+        print(f"Embedding cache: {embeddings.cache.stats()}")
         print(f"Library index saved to {DB_PATH}")
 
-    retriever = vector_db.as_retriever(search_kwargs={"k": 10})
     llm = ChatOllama(model="llama3")
 
     while True:
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -22,9 +22,10 @@ class Document(Base):
     __tablename__ = "documents"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # NULL for anonymous uploads
     filename = Column(String(255), nullable=False)
     file_path = Column(String(500), nullable=False)
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 of the file bytes
     upload_date = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -54,3 +55,41 @@ class VectorStore(Base):
     
     # Relationships
     user = relationship("User", back_populates="vector_store")
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # NULL for anonymous uploads
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued, running, succeeded, failed
+    total_pages = Column(Integer, nullable=False, default=0)
+    parsed_pages = Column(Integer, nullable=False, default=0)
+    total_chunks = Column(Integer, nullable=False, default=0)  # parsed so far
+    embedded_chunks = Column(Integer, nullable=False, default=0)  # checkpointed so far
+    indexed_chunks = Column(Integer, nullable=False, default=0)  # searchable so far
+    embedding_dim = Column(Integer, nullable=True)
+    chunks_fingerprint = Column(String(64), nullable=True)  # sha256 of the chunk digests, once fully parsed
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    # Relationships
+    files = relationship("IngestionJobFile", back_populates="job", cascade="all, delete-orphan", order_by="IngestionJobFile.id")
+
+class IngestionJobFile(Base):
+    __tablename__ = "ingestion_job_files"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("ingestion_jobs.id"), nullable=False, index=True)
+    filename = Column(String(255), nullable=False)
+    file_path = Column(String(500), nullable=False)
+    content_hash = Column(String(64), nullable=True)
+    replaces_existing = Column(Boolean, nullable=False, default=False)  # same name, new content
+    status = Column(String(20), nullable=False, default="pending")  # pending, parsed, indexed, failed
+    chunks = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+
+    # Relationships
+    job = relationship("IngestionJob", back_populates="files")
@@ -0,0 +1,390 @@
+"""
+Process-wide Ollama HTTP client, routing over pools of Ollama servers.
+
+One OllamaClient is shared by the whole app. Every Ollama server (node) gets
+a pooled keep-alive httpx.Client for code that runs in threads (ingestion
+workers, the query embedder) and an httpx.AsyncClient for the request path,
+so chat and ingest await Ollama natively instead of parking a threadpool
+thread per call. Connection limits and timeouts are configurable. Only the
+two endpoints the app uses are wrapped: /api/embed (batched embeddings) and
+/api/chat.
+
+Embeddings and generation each have their own pool of nodes (a server can be
+in both). Each request goes to the healthy node with the fewest requests in
+flight, with ties taken in turn. A request that fails because of the node (it
+can't be reached, drops the connection or answers 5xx) is retried on another
+node of the pool. A streamed answer is only retried if nothing has been
+streamed yet. After OLLAMA_EJECT_AFTER consecutive failures a node is taken
+out of rotation for OLLAMA_EJECT_SECONDS. A background health check pings
+every node each OLLAMA_HEALTH_INTERVAL seconds: it ejects nodes that don't
+answer and puts recovered nodes back. If every node of a pool is ejected,
+requests still try the one ejected longest ago rather than fail outright.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Union
+
+import httpx
+from langchain_core.embeddings import Embeddings
+
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+# Max wait for the next bytes of a response. Generation can be slow to start on a cold model.
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "600"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+# Seconds an idle pooled connection is kept open for reuse
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_EJECT_AFTER = int(os.getenv("OLLAMA_EJECT_AFTER", "2"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+
+# Failures that say something about the node rather than the request. Read
+# timeouts are not among them: the node is up, just slow, and re-running a long
+# generation elsewhere would only double the load.
+NODE_ERRORS = (
+    httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError, httpx.WriteError,
+    httpx.RemoteProtocolError, httpx.PoolTimeout,
+)
+
+class OllamaError(Exception):
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+def _raise_for_error(response: httpx.Response):
+    if response.status_code >= 400:
+        try:
+            detail = response.json().get("error", response.text)
+        except ValueError:
+            detail = response.text
+        raise OllamaError(f"Ollama returned {response.status_code}: {detail}", response.status_code)
+
+def node_failed(e: Exception) -> bool:
+    """Whether e means the node is unhealthy (and the request may succeed elsewhere)."""
+    if isinstance(e, OllamaError):
+        return e.status is not None and e.status >= 500
+    return isinstance(e, NODE_ERRORS)
+
+def parse_urls(urls: Union[str, List[str]]) -> List[str]:
+    if isinstance(urls, str):
+        urls = urls.split(",")
+    urls = [url.strip().rstrip("/") for url in urls if url.strip()]
+    if not urls:
+        raise ValueError("At least one Ollama URL is required")
+    return list(dict.fromkeys(urls))
+
+class OllamaNode:
+    """One Ollama server: its pooled HTTP clients, its load and its health."""
+
+    def __init__(self, url: str, timeout: httpx.Timeout, limits: httpx.Limits):
+        self.url = url
+        self._timeout = timeout
+        self._limits = limits
+        self._client = None
+        self._aclient = None
+        self._lock = threading.Lock()
+        # Guarded by the NodePool lock
+        self.outstanding = 0
+        self.failures = 0  # consecutive
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(base_url=self.url, timeout=self._timeout, limits=self._limits)
+            return self._client
+
+    @property
+    def aclient(self) -> httpx.AsyncClient:
+        # Created on first use, inside the server's event loop
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(base_url=self.url, timeout=self._timeout, limits=self._limits)
+        return self._aclient
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+    async def aclose(self):
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+class NodePool:
+    """Routes requests to the least-loaded healthy node, retrying node failures on another node."""
+
+    def __init__(self, name: str, nodes: List[OllamaNode], eject_after: int = OLLAMA_EJECT_AFTER,
+                 eject_seconds: float = OLLAMA_EJECT_SECONDS, lock: threading.Lock = None):
+        self.name = name
+        self.nodes = nodes
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.retries = 0
+        # Pools sharing nodes must share the lock too
+        self._lock = lock or threading.Lock()
+        self._turn = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _pick(self, tried: List[OllamaNode]) -> OllamaNode:
+        with self._lock:
+            candidates = [n for n in self.nodes if n not in tried] or self.nodes
+            healthy = [n for n in candidates if n.healthy]
+            if healthy:
+                # Least outstanding first; min() keeps the first of equals, so rotate to share ties
+                self._turn = (self._turn + 1) % len(healthy)
+                node = min(healthy[self._turn:] + healthy[:self._turn], key=lambda n: n.outstanding)
+            else:
+                node = min(candidates, key=lambda n: n.ejected_until)
+            node.outstanding += 1
+            node.requests += 1
+            return node
+
+    def _done(self, node: OllamaNode, error: Exception = None):
+        with self._lock:
+            node.outstanding -= 1
+            if error is None:
+                node.failures = 0
+            elif node_failed(error):
+                node.errors += 1
+                node.failures += 1
+                if node.failures >= self.eject_after and node.healthy:
+                    node.ejected_until = time.monotonic() + self.eject_seconds
+                    print(f"Ollama {self.name} node {node.url} ejected for {self.eject_seconds:.0f}s after {node.failures} failures")
+
+    def _retry(self, node: OllamaNode, error: Exception, tried: List[OllamaNode]) -> bool:
+        """Records a failed attempt. Returns whether to retry on another node."""
+        tried.append(node)
+        if not node_failed(error) or len(tried) >= len(self.nodes):
+            return False
+        self.retries += 1
+        print(f"Ollama {self.name} node {node.url} failed ({error!r}), retrying on another node")
+        return True
+
+    def call(self, request):
+        """Runs request(node) on the best node, retrying node failures elsewhere."""
+        tried = []
+        while True:
+            node = self._pick(tried)
+            error = None
+            try:
+                return request(node)
+            except Exception as e:
+                error = e
+                if not self._retry(node, e, tried):
+                    raise
+            finally:
+                self._done(node, error)
+
+    async def acall(self, request):
+        """Like call(), for request(node) returning an awaitable."""
+        tried = []
+        while True:
+            node = self._pick(tried)
+            error = None
+            try:
+                return await request(node)
+            except Exception as e:
+                error = e
+                if not self._retry(node, e, tried):
+                    raise
+            finally:
+                self._done(node, error)
+
+    async def astream(self, request) -> AsyncIterator:
+        """
+        Like acall(), for request(node) returning an async iterator: yields its items. A node
+        failure is only retried before the first item, since a retry would repeat what was yielded.
+        """
+        tried = []
+        while True:
+            node = self._pick(tried)
+            error = None
+            started = False
+            try:
+                async with aclosing(request(node)) as items:
+                    async for item in items:
+                        started = True
+                        yield item
+                return
+            except Exception as e:
+                error = e
+                if started or not self._retry(node, e, tried):
+                    raise
+            finally:
+                self._done(node, error)
+
+    def mark_health(self, node: OllamaNode, ok: bool):
+        """Result of a health check: ejects a node that failed it, re-admits one that passed it."""
+        with self._lock:
+            if ok and not node.healthy:
+                node.ejected_until = 0.0
+                node.failures = 0
+                print(f"Ollama {self.name} node {node.url} is back")
+            elif not ok and node.healthy:
+                node.ejected_until = time.monotonic() + self.eject_seconds
+                print(f"Ollama {self.name} node {node.url} failed its health check, ejected for {self.eject_seconds:.0f}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"retries": self.retries, "nodes": [node.stats() for node in self.nodes]}
+
+class OllamaClient:
+    def __init__(self, embed_urls: Union[str, List[str]], generate_urls: Union[str, List[str]] = None,
+                 connect_timeout: float = OLLAMA_CONNECT_TIMEOUT, read_timeout: float = OLLAMA_READ_TIMEOUT,
+                 max_connections: int = OLLAMA_MAX_CONNECTIONS, keepalive_expiry: float = OLLAMA_KEEPALIVE_EXPIRY):
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # A server in both pools is one node, so its load counts requests of both kinds
+        self._nodes: Dict[str, OllamaNode] = {}
+        def nodes(urls):
+            return [self._nodes.setdefault(url, OllamaNode(url, timeout, limits)) for url in parse_urls(urls)]
+        lock = threading.Lock()
+        self.embed_pool = NodePool("embed", nodes(embed_urls), lock=lock)
+        self.generate_pool = NodePool("generate", nodes(generate_urls or embed_urls), lock=lock)
+        self._health_timeout = httpx.Timeout(connect_timeout)
+        self._health_thread = None
+        self._stop = threading.Event()
+
+    # ------------------------------------------------------------------
+    # Embeddings
+    # ------------------------------------------------------------------
+
+    def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        def request(node):
+            response = node.client.post("/api/embed", json={"model": model, "input": texts})
+            _raise_for_error(response)
+            return response.json()["embeddings"]
+        return self.embed_pool.call(request)
+
+    async def aembed(self, model: str, texts: List[str]) -> List[List[float]]:
+        async def request(node):
+            response = await node.aclient.post("/api/embed", json={"model": model, "input": texts})
+            _raise_for_error(response)
+            return response.json()["embeddings"]
+        return await self.embed_pool.acall(request)
+
+    # ------------------------------------------------------------------
+    # Generation
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _chat_body(model: str, prompt: str, stream: bool) -> dict:
+        return {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": stream}
+
+    def chat(self, model: str, prompt: str) -> str:
+        def request(node):
+            response = node.client.post("/api/chat", json=self._chat_body(model, prompt, False))
+            _raise_for_error(response)
+            return response.json()["message"]["content"]
+        return self.generate_pool.call(request)
+
+    async def achat(self, model: str, prompt: str) -> str:
+        async def request(node):
+            response = await node.aclient.post("/api/chat", json=self._chat_body(model, prompt, False))
+            _raise_for_error(response)
+            return response.json()["message"]["content"]
+        return await self.generate_pool.acall(request)
+
+    async def astream_chat(self, model: str, prompt: str) -> AsyncIterator[str]:
+        """Yields the answer text piece by piece as Ollama generates it. Close it (aclosing) to stop early."""
+        async def request(node):
+            async with node.aclient.stream("POST", "/api/chat", json=self._chat_body(model, prompt, True)) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    _raise_for_error(response)
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if "error" in data:
+                        raise OllamaError(data["error"])
+                    content = data.get("message", {}).get("content")
+                    if content:
+                        yield content
+                    if data.get("done"):
+                        break
+
+        async with aclosing(self.generate_pool.astream(request)) as pieces:
+            async for piece in pieces:
+                yield piece
+
+    # ------------------------------------------------------------------
+    # Health checks
+    # ------------------------------------------------------------------
+
+    def check_health(self):
+        """Pings every node once and updates its pools."""
+        for node in list(self._nodes.values()):
+            try:
+                response = node.client.get("/api/version", timeout=self._health_timeout)
+                ok = response.status_code < 500
+            except httpx.HTTPError:
+                ok = False
+            for pool in (self.embed_pool, self.generate_pool):
+                if node in pool.nodes:
+                    pool.mark_health(node, ok)
+
+    def start_health_checks(self, interval: float = OLLAMA_HEALTH_INTERVAL):
+        if self._health_thread is not None or interval <= 0:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.check_health()
+                except Exception as e:
+                    print(f"Ollama health check failed: {e}")
+
+        self._health_thread = threading.Thread(target=run, name="ollama-health", daemon=True)
+        self._health_thread.start()
+
+    def stats(self) -> dict:
+        return {"embed": self.embed_pool.stats(), "generate": self.generate_pool.stats()}
+
+    async def aclose(self):
+        self._stop.set()
+        for node in self._nodes.values():
+            await node.aclose()
+
+class PooledEmbeddings(Embeddings):
+    """LangChain Embeddings backed by a shared OllamaClient (sync and native async)."""
+
+    def __init__(self, client: OllamaClient, model: str):
+        self.client = client
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.client.embed(self.model, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.client.aembed(self.model, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
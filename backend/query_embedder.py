@@ -0,0 +1,136 @@
+"""
+Query embedding with an in-memory LRU/TTL cache and micro-batching.
+
+Every chat question needs one embedding before retrieval. Repeated questions
+are served from an LRU keyed by normalized text. Concurrent cache misses are
+queued and a single worker thread sends them to the model together: it waits
+up to QUERY_BATCH_WINDOW_MS after the first queued query for others to arrive,
+then issues one batched embed call. Identical questions that are already
+queued or in flight share one result instead of being embedded twice.
+"""
+import os
+import re
+import time
+import queue
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "32"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_query(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip()
+
+class QueryEmbedder:
+    """Embeds queries through embeddings.embed_documents, with caching and micro-batching."""
+
+    def __init__(self, embeddings, max_entries: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL,
+                 window_ms: float = QUERY_BATCH_WINDOW_MS, max_batch: int = QUERY_BATCH_MAX):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._cache = OrderedDict()  # key -> (vector, expires_at), least recently used first
+        self._inflight = {}  # key -> Future, for queries queued or being embedded
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.batched_queries = 0
+        self.max_batch_seen = 0
+
+    def embed_query(self, text: str) -> List[float]:
+        vector, future = self._lookup_or_submit(text)
+        return vector if vector is not None else future.result()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Like embed_query, but waits for the batch without blocking a thread."""
+        vector, future = self._lookup_or_submit(text)
+        return vector if vector is not None else await asyncio.wrap_future(future)
+
+    def _lookup_or_submit(self, text: str):
+        """Returns (cached vector, None) on a hit, else (None, Future of the vector)."""
+        text = normalize_query(text)
+        # Case doesn't change what is being asked, so it shouldn't miss the cache
+        key = text.casefold()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry[0], None
+            self.misses += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                future = Future()
+                self._inflight[key] = future
+                self._queue.put((key, text, future))
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="query-embedder", daemon=True)
+                    self._worker.start()
+        return None, future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                vectors = self.embeddings.embed_documents([text for _, text, _ in batch])
+            except Exception as e:
+                with self._lock:
+                    for key, _, future in batch:
+                        self._inflight.pop(key, None)
+                        future.set_exception(e)
+                continue
+
+            expires_at = time.time() + self.ttl
+            with self._lock:
+                self.batches += 1
+                self.batched_queries += len(batch)
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+                for (key, _, future), vector in zip(batch, vectors):
+                    self._cache[key] = (vector, expires_at)
+                    self._cache.move_to_end(key)
+                    self._inflight.pop(key, None)
+                    future.set_result(vector)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "avg_batch_size": round(self.batched_queries / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+        }
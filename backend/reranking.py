@@ -0,0 +1,105 @@
+"""
+Post-retrieval stages that run between hybrid search and prompt building.
+
+Hybrid search returns RERANK_CANDIDATES fused candidates together with their
+stored embeddings. A configurable pipeline of stages (POST_RETRIEVAL_STAGES,
+comma-separated and applied in order) then picks the k passages that go into
+the prompt:
+
+  threshold  drops candidates whose cosine similarity to the question is below
+             RERANK_MIN_SIMILARITY (off at 0). The best candidate is always kept.
+  mmr        maximal marginal relevance: greedily picks the candidate with the
+             best trade-off between relevance and redundancy with the passages
+             already picked (MMR_LAMBDA: 1 = relevance only, 0 = diversity only).
+
+Each stage works on the whole candidate matrix with NumPy: MMR does one
+candidates x candidates similarity product, then k vectorized argmax steps.
+Nothing loops over documents in Python. More stages can be added with
+register_stage.
+"""
+import os
+from typing import Callable, Dict, List
+
+import numpy as np
+
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+POST_RETRIEVAL_STAGES = os.getenv("POST_RETRIEVAL_STAGES", "threshold,mmr")
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+RERANK_MIN_SIMILARITY = float(os.getenv("RERANK_MIN_SIMILARITY", "0"))
+
+# stage(query, vectors, relevance, k) -> indices into vectors, best first
+Stage = Callable[[np.ndarray, np.ndarray, np.ndarray, int], np.ndarray]
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def similarity_threshold(query: np.ndarray, vectors: np.ndarray, relevance: np.ndarray, k: int,
+                         min_similarity: float = RERANK_MIN_SIMILARITY) -> np.ndarray:
+    """Keeps candidates with cosine similarity >= min_similarity, in their original order."""
+    if min_similarity <= 0 or len(vectors) == 0:
+        return np.arange(len(vectors))
+    similarities = _normalize(vectors) @ _normalize(query)
+    keep = np.flatnonzero(similarities >= min_similarity)
+    # Candidates arrive best first: never leave the prompt without its best passage
+    return keep if len(keep) else np.arange(1)
+
+def mmr(query: np.ndarray, vectors: np.ndarray, relevance: np.ndarray, k: int,
+        lambda_mult: float = MMR_LAMBDA) -> np.ndarray:
+    """
+    Maximal marginal relevance over the candidates. relevance is any
+    higher-is-better score (the fused retrieval score); it is scaled to [0, 1]
+    so it is comparable with cosine similarity.
+    """
+    n = len(vectors)
+    k = min(k, n)
+    if k <= 1:
+        return np.argsort(-relevance)[:k]
+
+    normalized = _normalize(vectors)
+    similarity = normalized @ normalized.T
+    relevance = np.asarray(relevance, dtype=np.float32)
+    relevance = relevance / (np.abs(relevance).max() or 1.0)
+
+    selected = np.empty(k, dtype=np.int64)
+    available = np.ones(n, dtype=bool)
+    selected[0] = np.argmax(relevance)
+    available[selected[0]] = False
+    # Highest similarity of each candidate to anything already selected
+    redundancy = similarity[selected[0]].copy()
+    for i in range(1, k):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = np.argmax(scores)
+        selected[i] = best
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
+
+STAGES: Dict[str, Stage] = {
+    "threshold": similarity_threshold,
+    "mmr": mmr,
+}
+
+def register_stage(name: str, stage: Stage):
+    STAGES[name] = stage
+
+class PostRetrieval:
+    """Runs the configured stages and returns the indices of the k candidates to keep."""
+
+    def __init__(self, stages: str = POST_RETRIEVAL_STAGES):
+        names = [name.strip() for name in stages.split(",") if name.strip()]
+        unknown = [name for name in names if name not in STAGES]
+        if unknown:
+            raise ValueError(f"Unknown post-retrieval stage(s) {unknown}; available: {sorted(STAGES)}")
+        self.names = names
+        self.stages: List[Stage] = [STAGES[name] for name in names]
+
+    def __call__(self, query, vectors: np.ndarray, relevance, k: int) -> np.ndarray:
+        query = np.asarray(query, dtype=np.float32)
+        relevance = np.asarray(relevance, dtype=np.float32)
+        keep = np.arange(len(vectors))
+        for stage in self.stages:
+            keep = keep[stage(query, vectors[keep], relevance[keep], k)]
+        return keep[:k]
@@ -30,6 +30,7 @@ class LoginRequest(BaseModel):
 class DocumentResponse(BaseModel):
     id: int
     filename: str
+    content_hash: Optional[str] = None
     upload_date: datetime
     
     class Config:
@@ -44,3 +45,32 @@ class ChatMessageResponse(BaseModel):
     
     class Config:
         from_attributes = True
+
+# Ingestion job schemas
+class IngestionJobFileResponse(BaseModel):
+    filename: str
+    status: str
+    chunks: int
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class IngestionJobResponse(BaseModel):
+    id: int
+    status: str
+    total_pages: int
+    parsed_pages: int
+    total_chunks: int
+    embedded_chunks: int
+    indexed_chunks: int
+    progress: float = 0.0  # estimated fraction of the job done
+    attempts: int
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    files: List[IngestionJobFileResponse] = []
+
+    class Config:
+        from_attributes = True
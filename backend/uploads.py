@@ -0,0 +1,193 @@
+"""
+Streaming multipart receiver for PDF uploads.
+
+FastAPI's UploadFile only reaches the handler after the whole body has been
+spooled, and copying it from there is synchronous. Instead, /upload reads
+request.stream() and feeds the bytes to a python-multipart parser as they
+arrive. Each file part is written to a uniquely named ".part" file next to its
+destination and hashed on the way, so concurrent uploads of the same name
+never share a temp file. Parsing, writing and hashing run on a small dedicated
+thread pool (UPLOAD_WORKERS), in batches of up to UPLOAD_BUFFER_SIZE bytes, so
+the event loop only moves bytes around and many concurrent uploads can't
+take the threads chat requests need.
+
+Requests are rejected as soon as the offending bytes arrive:
+  413  a file is over MAX_UPLOAD_FILE_MB, or the request over MAX_UPLOAD_REQUEST_MB
+       (checked against Content-Length up front when the client sends one)
+  415  a file part doesn't start with the PDF magic bytes "%PDF-"
+  400  the body isn't multipart/form-data, holds no files, or holds two files
+       with the same name
+Partial files are removed on any error.
+"""
+import os
+import hashlib
+import tempfile
+from typing import List, Optional
+
+from fastapi import HTTPException, Request
+
+from executors import BoundedExecutor
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+MB = 1024 * 1024
+MAX_UPLOAD_FILE_MB = int(os.getenv("MAX_UPLOAD_FILE_MB", "500"))
+MAX_UPLOAD_REQUEST_MB = int(os.getenv("MAX_UPLOAD_REQUEST_MB", "2048"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+# Bytes collected from the socket before one hop to the upload pool
+UPLOAD_BUFFER_SIZE = 1 * MB
+PDF_MAGIC = b"%PDF-"
+
+upload_pool = BoundedExecutor(UPLOAD_WORKERS, UPLOAD_WORKERS * 4, "upload")
+
+class ReceivedFile:
+    def __init__(self, filename: str, file_path: str):
+        self.filename = filename
+        self.file_path = file_path  # final destination
+        self.size = 0
+        self.hasher = hashlib.sha256()
+        self.head = b""  # first bytes, until the magic number has been checked
+        self.checked = False
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=filename + ".", suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    @property
+    def content_hash(self) -> str:
+        return self.hasher.hexdigest()
+
+    def write(self, data: bytes):
+        if not self.checked:
+            self.head += data[:len(PDF_MAGIC)]
+            if len(self.head) >= len(PDF_MAGIC):
+                if not self.head.startswith(PDF_MAGIC):
+                    raise HTTPException(status_code=415, detail=f"{self.filename} is not a PDF file.")
+                self.checked = True
+        self.size += len(data)
+        if self.size > MAX_UPLOAD_FILE_MB * MB:
+            raise HTTPException(status_code=413, detail=f"{self.filename} is larger than {MAX_UPLOAD_FILE_MB} MB.")
+        self.hasher.update(data)
+        self._file.write(data)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class MultipartPdfReceiver:
+    """Synchronous multipart parser that writes file parts into folder. Driven by feed()."""
+
+    def __init__(self, boundary: bytes, folder: str):
+        self.folder = folder
+        self.files: List[ReceivedFile] = []
+        self.received = 0
+        self._current: Optional[ReceivedFile] = None
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def feed(self, data: bytes):
+        self.received += len(data)
+        if self.received > MAX_UPLOAD_REQUEST_MB * MB:
+            raise HTTPException(status_code=413, detail=f"Upload is larger than {MAX_UPLOAD_REQUEST_MB} MB.")
+        self._parser.write(data)
+
+    def finish(self):
+        self._parser.finalize()
+        if self._current is not None:
+            raise HTTPException(status_code=400, detail="Upload ended in the middle of a file.")
+        if not self.files:
+            raise HTTPException(status_code=400, detail="No files in upload.")
+
+    def discard(self):
+        for f in self.files + ([self._current] if self._current else []):
+            f.discard()
+        self._current = None
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = options.get(b"filename")
+        if not filename:
+            return  # a plain form field: ignored
+        # Never let a client-supplied name escape the user's folder
+        name = os.path.basename(filename.decode("utf-8", "replace").replace("\\", "/"))
+        if not name or name in (".", ".."):
+            raise HTTPException(status_code=400, detail="Invalid file name.")
+        if any(f.filename == name for f in self.files):
+            raise HTTPException(status_code=400, detail=f"{name} appears more than once in the upload.")
+        self._current = ReceivedFile(name, os.path.join(self.folder, name))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._current is not None:
+            self._current.write(data[start:end])
+
+    def _on_part_end(self):
+        if self._current is None:
+            return
+        if not self._current.checked:
+            # Shorter than the magic number itself
+            raise HTTPException(status_code=415, detail=f"{self._current.filename} is not a PDF file.")
+        self._current.close()
+        self.files.append(self._current)
+        self._current = None
+
+async def receive_pdfs(request: Request, folder: str) -> List[ReceivedFile]:
+    """
+    Streams the multipart body of request into folder. Returns the received
+    files (written to their .part paths), in upload order.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload.")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_REQUEST_MB * MB:
+        raise HTTPException(status_code=413, detail=f"Upload is larger than {MAX_UPLOAD_REQUEST_MB} MB.")
+
+    os.makedirs(folder, exist_ok=True)
+    receiver = MultipartPdfReceiver(boundary, folder)
+    buffer = bytearray()
+    try:
+        async for data in request.stream():
+            buffer += data
+            if len(buffer) >= UPLOAD_BUFFER_SIZE:
+                await upload_pool.run(receiver.feed, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await upload_pool.run(receiver.feed, bytes(buffer))
+        await upload_pool.run(receiver.finish)
+    except BaseException:
+        receiver.discard()
+        raise
+    return receiver.files
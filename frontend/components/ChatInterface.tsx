@@ -2,7 +2,7 @@ import { useState, useRef, useEffect } from 'react';
 import { Send, Sparkles, User, Bot, Plus, ArrowUp, Square, FileText } from 'lucide-react';
 import MagneticButton from './ui/MagneticButton';
 import LogoAF from './ui/LogoAF';
-import { sendChat, uploadFiles, type ChatMessage } from '@/lib/api';
+import { streamChat, uploadFiles, type ChatMessage } from '@/lib/api';
 import { cn } from '@/lib/utils';
 import { motion, AnimatePresence } from 'framer-motion';
 import ReactMarkdown from 'react-markdown';
@@ -58,16 +58,16 @@ export default function ChatInterface() {
         abortControllerRef.current = abortController;
 
         try {
-            const response = await sendChat(question, abortController.signal);
-
-            setMessages(prev => {
-                const withoutThinking = prev.slice(0, -1);
-                return [...withoutThinking, {
-                    role: 'assistant',
-                    content: response.answer,
-                    citations: response.citations
-                }];
-            });
+            let answer = '';
+            await streamChat(question, {
+                onToken: (content) => {
+                    answer += content;
+                    setMessages(prev => [...prev.slice(0, -1), { role: 'assistant', content: answer }]);
+                },
+                onCitations: (citations) => {
+                    setMessages(prev => [...prev.slice(0, -1), { role: 'assistant', content: answer, citations }]);
+                },
+            }, abortController.signal);
         } catch (error) {
             if (error instanceof Error && error.name === 'AbortError') {
                 console.log('Request aborted by user');
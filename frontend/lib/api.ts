@@ -66,6 +66,58 @@ export async function sendChat(question: string, signal?: AbortSignal): Promise<
     return res.json();
 }
 
+export interface StreamHandlers {
+    onSources?: (passages: { source: string; page: number; score: number }[]) => void;
+    onToken: (content: string) => void;
+    onCitations?: (citations: Citation[]) => void;
+}
+
+// Streams a chat answer over Server-Sent Events. Aborting the signal cancels generation on the server.
+export async function streamChat(question: string, handlers: StreamHandlers, signal?: AbortSignal): Promise<void> {
+    const res = await fetch(`${API_URL}/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ question }),
+        signal,
+    });
+
+    if (!res.ok || !res.body) {
+        const text = await res.text();
+        throw new Error(`Chat failed (${res.status}): ${text.substring(0, 200)}`);
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // SSE frames are separated by a blank line
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+
+            let event = 'message';
+            let data = '';
+            for (const line of frame.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            const payload = data ? JSON.parse(data) : {};
+
+            if (event === 'sources') handlers.onSources?.(payload.passages);
+            else if (event === 'token') handlers.onToken(payload.content);
+            else if (event === 'citations') handlers.onCitations?.(payload.citations);
+            else if (event === 'error') throw new Error(payload.detail || 'Chat failed');
+            else if (event === 'done') return;
+        }
+    }
+}
+
 export async function listDocuments(): Promise<{ documents: Document[]; total: number }> {
     const res = await fetch(`${API_URL}/list-documents`);
     if (!res.ok) {